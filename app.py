@@ -1,10 +1,25 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, stream_with_context
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, stream_with_context, current_app, abort
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-from src.helper import answer_query_stream, update_index_from_stream, create_or_get_index, is_strong_password
+import json
+import base64
+import binascii
+import click
+from datetime import datetime, timedelta
+from src.helper import answer_query_stream, create_or_get_index, ALL_NAMESPACES, is_strong_password, invalidate_retrieval_cache, retrieval_cache, retrieval_flights
+from src.jobs import enqueue_ingest_job, job_status, IngestQueueFull
+from src.manifest import delete_manifest
+from src.lexical import delete_lexical_index
+from src.context import prompt_stats
+from src.llm import answer_cache, stream_flights
+from src.history import history_writer
+from src.memory import conversation_memory
+from src.archive import archive_history, history_page, iter_history, tier_stats, HISTORY_HOT_DAYS
+from src.database import configure_database, init_pools, pool_stats, replica_reads, use_primary
+from src.admission import admission, AdmissionRejected
+from src.users import get_profile, invalidate_user, profile, user_cache_stats
 from dotenv import load_dotenv
-from src.models import db, User, ChatHistory, UserPDF
-from io import BytesIO
+from src.models import db, User, ChatHistory, ChatHistoryArchive, UserPDF, IngestJob
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
@@ -13,8 +28,20 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY")
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
+# Load tests against local fakes switch rate limiting off with RATELIMIT_ENABLED=false
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
+# memory:// keeps separate counters in every worker, multiplying each limit by the worker count;
+# the Procfile points this at REDIS_URL when the host provides one. limits has no SQLite storage.
+app.config['RATELIMIT_STORAGE_URI'] = os.getenv('RATELIMIT_STORAGE_URI', 'memory://')
 
+configure_database(app)
 db.init_app(app)
+init_pools(app, db)
+history_writer.init_app(app)
+
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 50))
+HISTORY_MAX_PAGE_SIZE = 500
+HISTORY_EXPORT_BATCH = 500
 
 limiter = Limiter(
     key_func=get_remote_address,
@@ -23,6 +50,10 @@ limiter = Limiter(
     headers_enabled=True,
 )
 
+def user_or_address():
+    """Rate limit key: the logged-in user, so users behind one address do not share a limit."""
+    return f"user:{session['username']}" if 'username' in session else get_remote_address()
+
 @app.route('/signup', methods=['GET', 'POST'])
 @limiter.limit("10 per minute")
 def signup():
@@ -42,6 +73,7 @@ def signup():
             new_user = User(username=username, password=hashed_pw)
             db.session.add(new_user)
             db.session.commit()
+            invalidate_user(username)
             return redirect(url_for('login'))
 
     return render_template('signup.html', error=error)
@@ -61,6 +93,9 @@ def login():
             error = 'Invalid password.'
         else:
             session['username'] = username
+            # Routes read the user id from here instead of looking the user up on every request
+            session['user_id'] = user.id
+            session['profile'] = profile(user)
             return redirect(url_for('index'))
 
     return render_template('login.html', error=error)
@@ -69,6 +104,8 @@ def login():
 @app.route('/logout')
 def logout():
     session.pop('username', None)
+    session.pop('user_id', None)
+    session.pop('profile', None)
     return redirect(url_for('login'))
 
 @app.route('/')
@@ -78,58 +115,149 @@ def index():
     return render_template('index.html')
 
 @app.route('/chat', methods=['POST'])
-@limiter.limit("50 per minute")
+@limiter.limit("50 per minute", key_func=user_or_address)
 def chat():
     if 'username' not in session:
         return jsonify({'response': 'Unauthorized'}), 401
 
     data = request.get_json()
     user_message = data.get('message', '')
-    namespace = data.get('namespace')
+    user_id = current_user_id()
+    namespace, namespaces, history = chat_context(session['username'], user_id, data.get('namespace'))
+    try:
+        ticket = admission.admit(user_id, admission.estimate_prompt(user_message, history, bool(namespace or namespaces)))
+    except AdmissionRejected as e:
+        return rejected(e)
+
+    bot_chunks = []
 
     def generate():
-        bot_chunks = []
-        for chunk in answer_query_stream(user_message, session['username'], namespace):
+        for chunk in answer_query_stream(user_message, session['username'], namespace, namespaces, history,
+                                         on_prompt=ticket.prompt_sent):
             bot_chunks.append(chunk)
             yield chunk
 
-        full_bot_response = ''.join(bot_chunks)
-        user = User.query.filter_by(username=session['username']).first()
-        new_chat = ChatHistory(
-            user_id=user.id,
-            user_message=user_message,
-            bot_response=full_bot_response
-        )
-        db.session.add(new_chat)
-        db.session.commit()
-
-    return Response(stream_with_context(generate()), mimetype='text/plain')
+        save_chat(user_id, session['username'], user_message, ''.join(bot_chunks))
+
+    response = Response(stream_with_context(generate()), mimetype='text/plain')
+    # Runs however the stream ends, including a client that leaves before the first chunk
+    response.call_on_close(lambda: ticket.settle(''.join(bot_chunks)))
+    return response
+
+def rejected(e):
+    return jsonify({'response': e.message}), 429, {'Retry-After': str(e.retry_after)}
+
+def current_user_id():
+    """The logged-in user's id, from the session; sessions from before it was stored there are filled in once."""
+    if 'user_id' not in session:
+        user = get_profile(session['username'])
+        if user is None:
+            abort(401)
+        session['user_id'] = user['id']
+        session['profile'] = user
+    return session['user_id']
+
+def chat_context(username, user_id, namespace):
+    """(namespace, namespaces, history) for a chat turn: the namespace sent by the chat UI resolved for
+    answer_query_stream, and the conversation memory. Reads the database once."""
+    if namespace != ALL_NAMESPACES:
+        return namespace, None, conversation_memory.history(username, user_id)
+    # Search every PDF the user has uploaded. The names are read in the same query as the memory's
+    # window, in its user_message column, on rows without an id.
+    turns = conversation_memory.window(username, user_id).subquery()
+    rows = db.session.execute(db.union_all(
+        db.select(turns.c.id, turns.c.user_message, turns.c.bot_response, turns.c.timestamp),
+        db.select(db.null(), UserPDF.pdf_name, db.null(), db.null()).where(UserPDF.user_id == user_id),
+    )).all()
+    namespaces = [row.user_message for row in rows if row.id is None]
+    history = conversation_memory.history_from(username, [row for row in rows if row.id is not None])
+    return None, namespaces, history
+
+def save_chat(user_id, username, user_message, bot_response):
+    # Written in bulk by the history writer's thread, so the stream never waits on the database
+    history_writer.record(username, user_message, bot_response, user_id=user_id)
+    conversation_memory.add_turn(username, user_message, bot_response)
 
 @app.route('/get_history', methods=['GET'])
+# Each "Load older messages" click is a request, so paging through history can't share the hourly default
+@limiter.limit("120 per minute", key_func=user_or_address)
+@replica_reads
 def get_history():
+    """One page of the user's history, oldest first, ending just before ?before=<cursor>.
+
+    next_cursor fetches the page of older turns and is null once there are none.
+    """
     if 'username' not in session:
-        return jsonify([])
+        return jsonify({'items': [], 'next_cursor': None})
 
-    user = User.query.filter_by(username=session['username']).first()
-    chats = ChatHistory.query.filter_by(user_id=user.id).order_by(ChatHistory.timestamp).all()
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'message': 'Invalid limit or cursor'}), 400
+
+    # Turns this worker has buffered for the user are written first so the page never misses them,
+    # and the page is then read from the primary, which the replica may not have caught up with
+    if history_writer.pending(session['username']):
+        history_writer.flush()
+        use_primary()
+
+    # Reads the hot table and, once that runs out, the archive
+    chats = history_page(current_user_id(), before, limit + 1)
+
+    older = len(chats) > limit
+    chats = chats[:limit][::-1]
+    history = [{
+        'user_message': chat['user_message'],
+        'bot_response': chat['bot_response'],
+        'timestamp': chat['timestamp'].isoformat()
+    } for chat in chats]
+
+    return jsonify({
+        'items': history,
+        'next_cursor': encode_cursor(chats[0]['timestamp'], chats[0]['id']) if older else None
+    })
+
+@app.route('/export_history', methods=['GET'])
+def export_history():
+    """The user's whole history as a JSON array, streamed from the database in batches."""
+    if 'username' not in session:
+        return jsonify({'message': 'Unauthorized'}), 401
 
-    history = []
-    for chat in chats:
-        history.append({
-            'user_message': chat.user_message,
-            'bot_response': chat.bot_response,
-            'timestamp': chat.timestamp.isoformat()
-        })
+    if history_writer.pending(session['username']):
+        history_writer.flush()
+    rows = iter_history(current_user_id(), batch=HISTORY_EXPORT_BATCH)
 
-    return jsonify(history)
+    def generate():
+        yield '['
+        for i, row in enumerate(rows):
+            yield (',' if i else '') + json.dumps({
+                'user_message': row['user_message'],
+                'bot_response': row['bot_response'],
+                'timestamp': row['timestamp'].isoformat()
+            })
+        yield ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json',
+                    headers={'Content-Disposition': 'attachment; filename=chat_history.json'})
+
+def encode_cursor(timestamp, chat_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{chat_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, chat_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError(cursor)
+    return datetime.fromisoformat(timestamp), int(chat_id)
 
 @app.route('/get_pdfs', methods=['GET'])
+@replica_reads
 def get_pdfs():
     if 'username' not in session:
         return jsonify([])
 
-    user = User.query.filter_by(username=session['username']).first()
-    pdfs = UserPDF.query.filter_by(user_id=user.id).all()
+    pdfs = UserPDF.query.filter_by(user_id=current_user_id()).all()
 
     pdf_list = []
     for pdf in pdfs:
@@ -147,7 +275,7 @@ def upload_pdf():
         return jsonify({'message': 'Unauthorized'}), 401
 
     username = session['username']
-    user = User.query.filter_by(username=username).first()
+    user_id = current_user_id()
 
     if 'pdf' not in request.files:
         return jsonify({'message': 'No file uploaded'}), 400
@@ -161,34 +289,41 @@ def upload_pdf():
     namespace = os.path.splitext(file.filename)[0]
 
     try:
-        file_stream = BytesIO(file.read())
-        update_message, chunks_indexed = update_index_from_stream(username, namespace, file_stream)
-
-        if not chunks_indexed:
-            return jsonify({
-                'message': f'File {file.filename} uploaded but contains no valid text — nothing was indexed.'
-            }), 400
-
-        # Save to the database if successfully indexed
-        existing = UserPDF.query.filter_by(user_id=user.id, pdf_name=namespace).first()
-        if not existing:
-            new_pdf = UserPDF(user_id=user.id, pdf_name=namespace)
-            db.session.add(new_pdf)
-            db.session.commit()
+        # Indexing runs on the ingestion worker pool; the UserPDF row is written when the job finishes
+        job = enqueue_ingest_job(current_app._get_current_object(), user_id, username, namespace,
+                                 file.filename, file.read())
 
         return jsonify({
-            'message': f'File {file.filename} uploaded and indexed!',
-            'namespace': namespace
-        }), 200
+            'message': f'File {file.filename} uploaded, indexing started.',
+            'namespace': namespace,
+            'job_id': job.id
+        }), 202
 
+    except IngestQueueFull as e:
+        return jsonify({'message': str(e)}), 503
     except Exception as e:
         return jsonify({'message': f"Error processing file: {str(e)}"}), 500
 
+@app.route('/ingest_status/<job_id>', methods=['GET'])
+@limiter.limit("120 per minute")
+def ingest_status(job_id):
+    if 'username' not in session:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    job = db.session.get(IngestJob, job_id)
+    if not job or job.user_id != current_user_id():
+        return jsonify({'message': 'Job not found'}), 404
+
+    return jsonify(job_status(job))
+
 @app.route('/create_db')
 def create_db():
     from flask import current_app
     with current_app.app_context():
         db.create_all()
+        # create_all skips indexes added to tables that already exist
+        for index in [*ChatHistory.__table__.indexes, *ChatHistoryArchive.__table__.indexes]:
+            index.create(db.engine, checkfirst=True)
     return "✅ Database tables created!"
 
 
@@ -203,16 +338,44 @@ def delete_pdf():
     username = session['username']
     index = create_or_get_index(username)
     index.delete(namespace=pdf_name, delete_all=True)  
+    delete_manifest(username, pdf_name)
+    delete_lexical_index(username, pdf_name)
+    invalidate_retrieval_cache(username, pdf_name)
 
     # delete from database
-    user = User.query.filter_by(username=username).first()
-    pdf_entry = UserPDF.query.filter_by(user_id=user.id, pdf_name=pdf_name).first()
+    pdf_entry = UserPDF.query.filter_by(user_id=current_user_id(), pdf_name=pdf_name).first()
     if pdf_entry:
         db.session.delete(pdf_entry)
         db.session.commit()
 
     return jsonify({'message': f"PDF '{pdf_name}' deleted!"})
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    if 'username' not in session:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    return jsonify({
+        'retrieval': retrieval_cache.stats(),
+        'llm': answer_cache.stats(),
+        'prompt_tokens': prompt_stats.stats(),
+        'history': history_writer.stats(),
+        'memory': conversation_memory.stats(),
+        'users': user_cache_stats(),
+        'db_pools': pool_stats.stats(),
+        'admission': admission.stats(),
+        'coalesced': {'retrieval': retrieval_flights.stats(), 'llm': stream_flights.stats()},
+    })
+
+@app.cli.command('archive-history')
+@click.option('--days', default=HISTORY_HOT_DAYS, show_default=True, help='Archive turns older than this many days.')
+def archive_history_command(days):
+    """Move old chat turns out of the hot chat_history table into the compressed archive."""
+    history_writer.flush()
+    moved, blobs = archive_history(datetime.utcnow() - timedelta(days=days))
+    click.echo(f"Archived {moved} turns into {blobs} blobs")
+    click.echo(json.dumps(tier_stats()))
+
 @app.errorhandler(429)
 def ratelimit_handler(e):
     return jsonify(error="Too many requests, slow down!"), 429
@@ -0,0 +1,162 @@
+"""ASGI entry point: /chat streams on the event loop, every other route runs the Flask app.
+
+The WSGI /chat holds a worker thread for the whole OpenAI stream. Here the stream
+is awaited with AsyncOpenAI, so one process can serve hundreds of answers at once.
+Retrieval and the database writes are blocking, so they run on threads.
+
+    gunicorn asgi:application -k uvicorn_worker.UvicornWorker
+"""
+import os
+import json
+import asyncio
+from a2wsgi import WSGIMiddleware
+from flask import session
+from werkzeug.exceptions import HTTPException
+from app import app, chat_context, save_chat
+from src.admission import admission, AdmissionRejected
+from src.helper import answer_query_astream
+from src.users import get_profile
+
+# Threads that run the plain Flask routes (uploads, history, PDFs) for this worker
+wsgi = WSGIMiddleware(app, workers=int(os.getenv("WSGI_THREADS", 16)))
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_simple(send, status, payload, content_type="application/json", headers=()):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()),
+                            *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _authorize(scope, body):
+    """Run the Flask session and before_request hooks (rate limits) for a /chat request.
+
+    Returns ((username, user_id), None) if the request may proceed, otherwise (None, (status, payload)).
+    user_id is None for sessions from before login stored it.
+    """
+    headers = [(key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"]]
+    client = scope.get("client") or ("127.0.0.1", 0)
+    with app.test_request_context("/chat", method="POST", headers=headers, data=body,
+                                  environ_base={"REMOTE_ADDR": client[0]}):
+        try:
+            response = app.preprocess_request()
+        except HTTPException as e:
+            return None, (e.code, {"response": e.description})
+        if response is not None:
+            response = app.make_response(response)
+            return None, (response.status_code, response.get_data())
+        if "username" not in session:
+            return None, (401, {"response": "Unauthorized"})
+        return (session["username"], session.get("user_id")), None
+
+
+def _prepare(username, user_id, namespace):
+    with app.app_context():
+        if user_id is None:
+            user = get_profile(username)
+            if user is None:
+                return None
+            user_id = user["id"]
+        return user_id, *chat_context(username, user_id, namespace)
+
+
+def _admit(user_id, user_message, history, retrieves):
+    try:
+        return admission.admit(user_id, admission.estimate_prompt(user_message, history, retrieves)), None
+    except AdmissionRejected as e:
+        return None, e
+
+
+def _save(user_id, username, user_message, bot_response):
+    with app.app_context():
+        save_chat(user_id, username, user_message, bot_response)
+
+
+async def _watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            return
+
+
+async def chat(scope, receive, send):
+    body = await _read_body(receive)
+    if body is None:
+        return
+    identity, rejection = _authorize(scope, body)
+    if rejection:
+        await _send_simple(send, *rejection)
+        return
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        await _send_simple(send, 400, {"response": "Invalid JSON"})
+        return
+    user_message = data.get("message", "")
+    username, user_id = identity
+    prepared = await asyncio.to_thread(_prepare, username, user_id, data.get("namespace"))
+    if prepared is None:
+        await _send_simple(send, 401, {"response": "Unauthorized"})
+        return
+    user_id, namespace, namespaces, history = prepared
+    # Refused before retrieval or OpenAI is touched, so an overloaded worker answers 429s quickly
+    ticket, rejected = await asyncio.to_thread(_admit, user_id, user_message, history, bool(namespace or namespaces))
+    if rejected:
+        await _send_simple(send, 429, {"response": rejected.message},
+                           headers=[(b"retry-after", str(rejected.retry_after).encode())])
+        return
+
+    # Stop pulling from OpenAI as soon as the browser goes away
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(_watch_disconnect(receive, disconnected))
+    bot_chunks = []
+    stream = answer_query_astream(user_message, username, namespace, namespaces, history,
+                                  on_prompt=ticket.prompt_sent)
+    try:
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+        async for chunk in stream:
+            if disconnected.is_set():
+                break
+            bot_chunks.append(chunk)
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+        else:
+            await send({"type": "http.response.body", "body": b""})
+            await asyncio.to_thread(_save, user_id, username, user_message, "".join(bot_chunks))
+    finally:
+        watcher.cancel()
+        await asyncio.to_thread(ticket.settle, "".join(bot_chunks))
+        await stream.aclose()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/chat" and scope["method"] == "POST":
+        await chat(scope, receive, send)
+    else:
+        await wsgi(scope, receive, send)
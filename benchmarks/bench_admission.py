@@ -0,0 +1,84 @@
+"""/chat latency under overload, with and without upstream concurrency limits.
+
+Starts benchmarks.fake_openai with --capacity streams at full speed (more share the
+token rate, like a saturated upstream) and one async app worker. Chats arrive at
+--rate per second, open loop, for --duration seconds, so an overloaded server gets
+no relief from slow answers. Each configuration reports how many chats were
+answered or refused, and the latency of both.
+
+    python -m benchmarks.bench_admission --capacity 16 --rate 30 --duration 20
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+import uuid
+
+import httpx
+
+from benchmarks.harness import app_env, free_port, login, percentile, start_app, start_fake_openai, stop
+
+
+async def one_chat(client, results):
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", "/chat", json={"message": f"question {uuid.uuid4().hex}"}) as response:
+            async for _ in response.aiter_bytes():
+                pass
+        kind = "answered" if response.status_code == 200 else str(response.status_code)
+    except httpx.HTTPError as e:
+        kind = type(e).__name__
+    results.setdefault(kind, []).append(time.perf_counter() - started)
+
+
+async def offer(base_url, cookies, rate, duration):
+    results = {}
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, timeout=120, limits=limits) as client:
+        tasks = []
+        started = time.perf_counter()
+        for i in range(int(rate * duration)):
+            await asyncio.sleep(max(0.0, started + i / rate - time.perf_counter()))
+            tasks.append(asyncio.create_task(one_chat(client, results)))
+        await asyncio.gather(*tasks)
+    return results
+
+
+def run(name, settings, args):
+    fake, openai_url = start_fake_openai(args.tokens, args.token_rate, args.latency, args.capacity)
+    workdir = tempfile.mkdtemp()
+    port = free_port()
+    env = app_env(workdir, openai_url, **settings)
+    app = start_app("async", port, env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        results = asyncio.run(offer(base_url, login(base_url), args.rate, args.duration))
+    finally:
+        stop(app)
+        stop(fake)
+    for kind, latencies in sorted(results.items()):
+        print(f"{name:>12} {kind:>10} {len(latencies):>6} {percentile(latencies, 50) * 1000:>9.0f} "
+              f"{percentile(latencies, 99) * 1000:>9.0f} {max(latencies) * 1000:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capacity", type=int, default=16, help="upstream streams served at full speed")
+    parser.add_argument("--rate", type=float, default=30, help="chats per second offered")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-rate", type=float, default=50)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--backend", default="sqlite", help="ADMISSION_BACKEND for the limited run")
+    args = parser.parse_args()
+
+    print(f"{'config':>12} {'outcome':>10} {'count':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    # Token budgets are off so only concurrency decides; an answer cache hit would skip the upstream
+    common = {"TOKEN_BUDGET": "0", "LLM_CACHE_SIZE": "0"}
+    run("unlimited", {**common, "UPSTREAM_MAX_CONCURRENCY": "0"}, args)
+    run("limited", {**common, "UPSTREAM_MAX_CONCURRENCY": str(args.capacity), "ADMISSION_BACKEND": args.backend},
+        args)
+
+
+if __name__ == "__main__":
+    main()
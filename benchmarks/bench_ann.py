@@ -0,0 +1,78 @@
+"""Recall@k and query latency of memory-mapped IVF segments versus brute-force search.
+
+    python -m benchmarks.bench_ann --sizes 10000 100000 1000000 --dim 128
+
+Vectors are drawn around random cluster centres, like chunk embeddings of a document
+that keeps returning to a handful of topics; queries are perturbed copies of stored vectors.
+"""
+import argparse
+import tempfile
+import time
+import os
+import numpy as np
+
+from src.segments import Segment, write_segment
+
+
+def clustered_vectors(rng, count, dim, clusters=256, noise=1.0):
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 100000):
+        stop = min(start + 100000, count)
+        vectors[start:stop] = centres[rng.integers(0, clusters, stop - start)]
+        vectors[start:stop] += noise * rng.standard_normal((stop - start, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def percentiles(samples):
+    return np.percentile(np.array(samples) * 1000, [50, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>8} {'build s':>8} {'lists':>6} {'recall@k':>9} "
+          f"{'brute p50':>10} {'brute p99':>10} {'ivf p50':>8} {'ivf p99':>8}  (ms)")
+    for size in args.sizes:
+        vectors = clustered_vectors(rng, size, args.dim)
+        picks = rng.integers(0, size, args.queries)
+        queries = vectors[picks] + 0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32) / np.sqrt(args.dim)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "segment")
+            start = time.perf_counter()
+            write_segment(path, [str(i) for i in range(size)], [{}] * size, vectors)
+            build = time.perf_counter() - start
+            segment = Segment(path)
+            stored = np.asarray(segment.vectors)
+
+            brute_times, ivf_times, found = [], [], 0
+            for query in queries:
+                start = time.perf_counter()
+                scores = stored @ query
+                exact = np.argpartition(-scores, args.k - 1)[:args.k]
+                brute_times.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                rows, _ = segment.search(query, args.k, args.nprobe)
+                ivf_times.append(time.perf_counter() - start)
+                found += len(set(exact.tolist()) & set(rows.tolist()))
+
+            brute = percentiles(brute_times)
+            ivf = percentiles(ivf_times)
+            print(f"{size:>8} {build:>8.1f} {len(segment.lists) - 1:>6} {found / (args.k * args.queries):>9.3f} "
+                  f"{brute[0]:>10.2f} {brute[1]:>10.2f} {ivf[0]:>8.2f} {ivf[1]:>8.2f}")
+            del segment, stored
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Hot table size, /get_history latency and a full-scan analytics query before and after archiving.
+
+Fills a throwaway SQLite database with a synthetic history spread evenly over --days
+across --users, then moves everything older than --hot-days into the compressed archive.
+The full-size run takes a long time and several GB of disk; pass --rows to shrink it.
+
+    python -m benchmarks.bench_archive --rows 10000000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+os.environ.setdefault("PINECONE_API_KEY", "unused")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["RATELIMIT_ENABLED"] = "false"
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir, 'archive.db')}"
+os.environ["HISTORY_SPILL_DIR"] = os.path.join(workdir, "spill")
+
+from app import app, db, User, ChatHistory, encode_cursor  # noqa: E402
+from src.archive import archive_history, tier_stats  # noqa: E402
+
+USERNAME = "bench"
+PASSWORD = "Bench123!"
+INSERT_BATCH = 20000
+
+
+def fill(user_ids, rows, start, end):
+    """rows turns, round-robin over user_ids, with timestamps evenly spaced from start to end."""
+    step = (end - start) / rows
+    batch = []
+    for i in range(rows):
+        batch.append({"user_id": user_ids[i % len(user_ids)], "user_message": f"question {i} about the report",
+                      "bot_response": "The report says that revenue grew in the third quarter. " * 4,
+                      "timestamp": start + step * i})
+        if len(batch) >= INSERT_BATCH:
+            db.session.execute(db.insert(ChatHistory), batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.execute(db.insert(ChatHistory), batch)
+        db.session.commit()
+
+
+def hot_table_bytes():
+    # dbstat is an optional SQLite extension; most builds include it
+    try:
+        return db.session.execute(db.text("SELECT sum(pgsize) FROM dbstat WHERE name = 'chat_history'")).scalar()
+    except Exception:
+        db.session.rollback()
+        return None
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def measure(client, cutoff, repeat):
+    def page(path):
+        response = client.get(path)
+        assert response.status_code == 200
+
+    def scan():
+        with app.app_context():
+            db.session.execute(db.text(
+                "SELECT count(*), sum(length(bot_response)) FROM chat_history WHERE bot_response LIKE '%quarter%'"
+            )).one()
+
+    with app.app_context():
+        stats = tier_stats()
+        stats["hot_bytes"] = hot_table_bytes()
+    stats["newest_page_ms"] = timed(lambda: page("/get_history"), repeat)
+    stats["old_page_ms"] = timed(lambda: page(f"/get_history?before={encode_cursor(cutoff, 0)}"), repeat)
+    stats["scan_ms"] = timed(scan, max(1, repeat // 10))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--hot-days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    client.get("/create_db")
+    client.post("/signup", data={"username": USERNAME, "password": PASSWORD})
+    client.post("/login", data={"username": USERNAME, "password": PASSWORD})
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=args.hot_days)
+    with app.app_context():
+        bench_id = User.query.filter_by(username=USERNAME).first().id
+        db.session.execute(db.insert(User), [{"username": f"user{i}", "password": "unused"}
+                                             for i in range(1, args.users)])
+        db.session.commit()
+        user_ids = [bench_id] + [user.id for user in User.query.filter(User.id != bench_id)]
+        started = time.perf_counter()
+        fill(user_ids, args.rows, now - timedelta(days=args.days), now)
+        print(f"inserted {args.rows} rows for {len(user_ids)} users in {time.perf_counter() - started:.1f}s")
+
+    before = measure(client, cutoff, args.repeat)
+    with app.app_context():
+        started = time.perf_counter()
+        moved, blobs = archive_history(cutoff)
+        print(f"archived {moved} rows into {blobs} blobs in {time.perf_counter() - started:.1f}s")
+        db.session.execute(db.text("VACUUM"))
+    after = measure(client, cutoff, args.repeat)
+
+    print(f"{'':>16} {'before':>14} {'after':>14}")
+    for key in ["hot_rows", "hot_bytes", "archived_rows", "archive_blobs", "archive_bytes",
+                "newest_page_ms", "old_page_ms", "scan_ms"]:
+        row = [before[key], after[key]]
+        print(f"{key:>16} " + " ".join(f"{value:>14.2f}" if isinstance(value, float) else f"{str(value):>14}"
+                                        for value in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Chunks/second and chunk-size spread of the token chunker versus RecursiveCharacterTextSplitter.
+
+    python -m benchmarks.bench_chunker --pages 500
+"""
+import argparse
+import random
+import statistics
+import time
+
+from langchain.schema import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.synthetic import make_page_text
+from src.chunker import iter_token_chunks, get_encoding
+
+
+def recursive_splitter(pages):
+    # The splitter ingestion used before the token chunker, built once per upload
+    splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=50)
+    for page in pages:
+        yield from splitter.split_documents([page])
+
+
+def measure(name, chunker, pages):
+    start = time.perf_counter()
+    chunks = list(chunker(pages))
+    elapsed = time.perf_counter() - start
+
+    encoding = get_encoding()
+    sizes = [len(tokens) for tokens in encoding.encode_ordinary_batch([c.page_content for c in chunks])]
+    print(f"{name:<12} {len(chunks):>7} {len(chunks) / elapsed:>10.0f} {statistics.mean(sizes):>8.1f} "
+          f"{statistics.pstdev(sizes):>7.1f} {min(sizes):>5} {max(sizes):>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pages = [Document(page_content=make_page_text(rng, page), metadata={"page": page}) for page in range(args.pages)]
+    get_encoding()
+
+    print(f"{'chunker':<12} {'chunks':>7} {'chunks/s':>10} {'mean tok':>8} {'stdev':>7} {'min':>5} {'max':>5}")
+    measure("recursive", recursive_splitter, pages)
+    measure("token", iter_token_chunks, pages)
+
+
+if __name__ == "__main__":
+    main()
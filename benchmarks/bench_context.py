@@ -0,0 +1,87 @@
+"""Prompt size and time to first token with and without context packing on long chunks.
+
+"unpacked" joins every retrieved chunk, as answers did before pack_context;
+"packed" fills CONTEXT_TOKEN_BUDGET in retrieval order. Each prompt is streamed from
+benchmarks.fake_openai started with --prefill-rate, so its first token waits for the
+prompt to be read the way an upstream's does. Pass --base-url and --model (with
+OPENAI_API_KEY set) to measure a real OpenAI-compatible endpoint instead.
+
+    python -m benchmarks.bench_context --chunks 8 --paragraphs 12 --requests 20
+"""
+import argparse
+import random
+import statistics
+import time
+
+from langchain.schema import Document
+from openai import OpenAI
+
+from benchmarks.harness import percentile, start_fake_openai, stop
+from benchmarks.synthetic import make_page_text
+from src.context import CONTEXT_TOKEN_BUDGET, count_tokens, pack_context
+
+
+def long_chunks(count, paragraphs):
+    rng = random.Random(0)
+    docs = []
+    for rank in range(count):
+        text = make_page_text(rng, rank, paragraphs)
+        docs.append(Document(page_content=text, metadata={"rrf": 1 / (61 + rank), "token_count": count_tokens(text)}))
+    return docs
+
+
+def messages(context, query="What does fault code E-0101 mean?"):
+    prompt = f"Answer the user using ONLY the context below if possible.\n\nContext:\n{context}\n\nQuestion:\n{query}"
+    return [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}]
+
+
+def first_token_seconds(client, model, prompt):
+    started = time.perf_counter()
+    stream = client.chat.completions.create(model=model, messages=prompt, stream=True, max_tokens=16)
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                return time.perf_counter() - started
+    finally:
+        stream.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=8, help="chunks retrieved per question")
+    parser.add_argument("--paragraphs", type=int, default=12, help="paragraphs per chunk; 12 is about 2,000 tokens")
+    parser.add_argument("--requests", type=int, default=20, help="streams per configuration")
+    parser.add_argument("--prefill-rate", type=float, default=4000, help="fake upstream prompt tokens per second")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake upstream seconds before prefill")
+    parser.add_argument("--base-url", help="OpenAI-compatible endpoint to measure instead of the fake")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    args = parser.parse_args()
+
+    docs = long_chunks(args.chunks, args.paragraphs)
+    configs = [("unpacked", pack_context(docs, budget=10 ** 9)), ("packed", pack_context(docs))]
+
+    fake = None
+    if args.base_url:
+        client = OpenAI(base_url=args.base_url)
+    else:
+        fake, url = start_fake_openai(16, 1000, args.latency, prefill_rate=args.prefill_rate)
+        client = OpenAI(base_url=url, api_key="fake")
+    try:
+        print(f"budget {CONTEXT_TOKEN_BUDGET} tokens, {args.chunks} chunks of ~{docs[0].metadata['token_count']} tokens")
+        print(f"{'config':>9} {'chunks':>7} {'prompt tokens':>14} {'ttft p50 ms':>12} {'ttft p95 ms':>12}")
+        for name, (context, _, used) in configs:
+            prompt = messages(context)
+            tokens = sum(count_tokens(message["content"]) + 4 for message in prompt)
+            # One unmeasured request opens the connection
+            first_token_seconds(client, args.model, prompt)
+            ttft = [first_token_seconds(client, args.model, prompt) for _ in range(args.requests)]
+            print(f"{name:>9} {used:>7} {tokens:>14} {statistics.median(ttft) * 1000:>12.0f} "
+                  f"{percentile(ttft, 95) * 1000:>12.0f}")
+    finally:
+        if fake:
+            stop(fake)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Pages/second of PDF extraction + chunking versus worker count.
+
+    python -m benchmarks.bench_extract --pages 300 600 --workers 1 2 4 8
+"""
+import argparse
+import os
+import time
+from io import BytesIO
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("PINECONE_API_KEY", "benchmark")
+
+from benchmarks.synthetic import make_pdf
+from src.helper import iter_document_chunks
+
+
+def run(data, workers):
+    start = time.perf_counter()
+    chunks = sum(1 for _ in iter_document_chunks(BytesIO(data), workers))
+    return time.perf_counter() - start, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[300, 600])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'workers':>8} {'seconds':>8} {'pages/s':>9} {'chunks':>7}")
+    for pages in args.pages:
+        data = make_pdf(pages)
+        for workers in sorted(set(args.workers)):
+            elapsed, chunks = run(data, workers)
+            print(f"{pages:>6} {workers:>8} {elapsed:>8.2f} {pages / elapsed:>9.1f} {chunks:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""/get_history latency for the newest page and for a deep page as one user's history grows.
+
+Keyset pagination on (timestamp, id) with the ix_chat_history_user_time index should
+keep both flat. Uses a throwaway SQLite database.
+
+    python -m benchmarks.bench_history --rows 1000 10000 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+os.environ.setdefault("PINECONE_API_KEY", "unused")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["RATELIMIT_ENABLED"] = "false"
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir, 'history.db')}"
+os.environ["HISTORY_SPILL_DIR"] = os.path.join(workdir, "spill")
+
+from app import app, db, User, ChatHistory  # noqa: E402
+
+USERNAME = "bench"
+PASSWORD = "Bench123!"
+
+
+def grow(user_id, start, stop, other_users=4):
+    """Add rows for the benchmark user interleaved with rows for other users."""
+    base = datetime(2024, 1, 1)
+    rows = []
+    for i in range(start, stop):
+        for owner in [user_id] + list(range(user_id + 1, user_id + 1 + other_users)):
+            rows.append({"user_id": owner, "user_message": f"question {i}", "bot_response": "answer " * 40,
+                         "timestamp": base + timedelta(seconds=i)})
+        if len(rows) >= 20000:
+            db.session.execute(db.insert(ChatHistory), rows)
+            rows = []
+    if rows:
+        db.session.execute(db.insert(ChatHistory), rows)
+    db.session.commit()
+
+
+def timed(client, path, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path)
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, response.get_json()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    client.get("/create_db")
+    client.post("/signup", data={"username": USERNAME, "password": PASSWORD})
+    client.post("/login", data={"username": USERNAME, "password": PASSWORD})
+    with app.app_context():
+        user_id = User.query.filter_by(username=USERNAME).first().id
+
+    print(f"{'rows':>8} {'newest page ms':>15} {'page 10 ms':>11}")
+    loaded = 0
+    for rows in sorted(args.rows):
+        with app.app_context():
+            grow(user_id, loaded, rows)
+        loaded = rows
+        newest, page = timed(client, "/get_history", args.repeat)
+        cursor = page["next_cursor"]
+        for _ in range(8):
+            cursor = client.get(f"/get_history?before={cursor}").get_json()["next_cursor"]
+        deep, _ = timed(client, f"/get_history?before={cursor}", args.repeat)
+        print(f"{rows:>8} {newest:>15.2f} {deep:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Cost of MMR diversity selection versus the number of over-fetched candidates.
+
+    python -m benchmarks.bench_mmr --candidates 16 32 64 128 256 512
+"""
+import argparse
+import random
+import time
+
+from langchain.schema import Document
+
+from benchmarks.synthetic import make_page_text
+from src.diversity import diversify
+
+
+def candidates(rng, count):
+    docs = []
+    for i in range(count):
+        text = make_page_text(rng, i, paragraphs=1)
+        if i % 4 == 1:
+            # Overlapping chunk: shares most of its text with the previous candidate
+            text = docs[-1].page_content[len(docs[-1].page_content) // 5:] + " " + text[:80]
+        docs.append(Document(page_content=text, metadata={"rrf": 1 / (61 + i)}))
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--candidates", type=int, nargs="+", default=[16, 32, 64, 128, 256, 512])
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'candidates':>10} {'ms/select':>10}")
+    for count in args.candidates:
+        docs = candidates(rng, count)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            diversify(docs, args.k)
+        print(f"{count:>10} {(time.perf_counter() - start) / args.repeat * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Connections opened and DB time under concurrent load for different pool settings.
+
+Each configuration runs in its own process against a fresh copy of one seeded SQLite
+database, with --threads threads (one a2wsgi worker's worth by default) hammering
+/get_history and /get_pdfs while a writer inserts UserPDF rows. "replica" points
+SQLALCHEMY_REPLICA_URI at a second copy of the database. Pass --primary-uri to run
+against Postgres instead; the replica configuration is then skipped unless
+--replica-uri is also given. Tail times on a small box move a lot between runs, so
+each configuration runs --repeat times and the medians are reported.
+
+    python -m benchmarks.bench_pool --threads 16 --seconds 20 --repeat 3
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.harness import ROOT, percentile
+
+USERS = 50
+PASSWORD = "Bench123!"
+
+# SQLAlchemy's own QueuePool defaults, which the app used before pooling was configurable
+DEFAULTS = {"DB_POOL_SIZE": "5", "DB_MAX_OVERFLOW": "10", "DB_POOL_RECYCLE": "-1", "DB_POOL_PRE_PING": "false"}
+
+
+def base_env(workdir, uri):
+    return {"OPENAI_API_KEY": "unused", "PINECONE_API_KEY": "unused", "SECRET_KEY": "benchmark",
+            "RATELIMIT_ENABLED": "false", "SQLALCHEMY_DATABASE_URI": uri,
+            "HISTORY_SPILL_DIR": os.path.join(workdir, "spill")}
+
+
+def seed(rows_per_user):
+    from app import app, db, User, ChatHistory, UserPDF
+
+    client = app.test_client()
+    client.get("/create_db")
+    with app.app_context():
+        for i in range(USERS):
+            client.post("/signup", data={"username": f"bench{i}", "password": PASSWORD})
+        start = datetime.utcnow() - timedelta(days=1)
+        for user in User.query.all():
+            db.session.execute(db.insert(ChatHistory), [
+                {"user_id": user.id, "user_message": f"question {i}", "bot_response": "answer " * 40,
+                 "timestamp": start + timedelta(seconds=i)} for i in range(rows_per_user)])
+            db.session.execute(db.insert(UserPDF), [
+                {"user_id": user.id, "pdf_name": f"report-{i}.pdf"} for i in range(5)])
+        db.session.commit()
+
+
+def run(threads, seconds):
+    from sqlalchemy import event
+    from app import app, db, UserPDF
+    from src.database import pool_stats
+
+    statement_ms = []
+    queries = {}
+    started_at = threading.local()
+    with app.app_context():
+        engines = dict(db.engines)
+    for name, engine in engines.items():
+        name = name or "primary"
+        queries[name] = 0
+
+        def before(*_):
+            started_at.value = time.perf_counter()
+
+        def after(*_, name=name):
+            statement_ms.append((time.perf_counter() - started_at.value) * 1000)
+            queries[name] += 1
+
+        event.listen(engine, "before_cursor_execute", before)
+        event.listen(engine, "after_cursor_execute", after)
+
+    request_ms = []
+    errors = []
+    deadline = time.monotonic() + seconds
+
+    def reader(i):
+        client = app.test_client()
+        client.post("/login", data={"username": f"bench{i % USERS}", "password": PASSWORD})
+        n = 0
+        while time.monotonic() < deadline:
+            path = "/get_pdfs" if n % 3 == 2 else "/get_history"
+            started = time.perf_counter()
+            response = client.get(path)
+            request_ms.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+            n += 1
+
+    def writer():
+        n = 0
+        while time.monotonic() < deadline:
+            with app.app_context():
+                db.session.add(UserPDF(user_id=n % USERS + 1, pdf_name=f"upload-{n}.pdf"))
+                db.session.commit()
+            n += 1
+            time.sleep(0.01)
+
+    workers = [threading.Thread(target=reader, args=(i,)) for i in range(threads)]
+    workers.append(threading.Thread(target=writer))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    opened = {name: stats["opened"] for name, stats in pool_stats.stats().items()}
+    print(json.dumps({
+        "requests": len(request_ms), "errors": len(errors),
+        "request_p99_ms": percentile(request_ms, 99),
+        "db_p50_ms": percentile(statement_ms, 50), "db_p99_ms": percentile(statement_ms, 99),
+        "queries": queries, "opened": opened,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--rows-per-user", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--primary-uri", help="database to benchmark instead of a throwaway SQLite file")
+    parser.add_argument("--replica-uri")
+    parser.add_argument("--seed", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        return seed(args.rows_per_user)
+    if args.run:
+        return run(args.threads, args.seconds)
+
+    workdir = tempfile.mkdtemp()
+    seeded = os.path.join(workdir, "seed.db")
+    primary_uri = args.primary_uri or f"sqlite:///{seeded}"
+    child = [sys.executable, "-m", "benchmarks.bench_pool", "--threads", str(args.threads),
+             "--seconds", str(args.seconds), "--rows-per-user", str(args.rows_per_user)]
+    subprocess.run(child + ["--seed"], cwd=ROOT, env={**os.environ, **base_env(workdir, primary_uri)}, check=True)
+
+    configs = [("defaults", DEFAULTS, False), ("tuned", {}, False), ("tuned+replica", {}, True)]
+    results = {}
+    # Runs of each configuration are interleaved so drift on the box affects them alike
+    for _ in range(args.repeat):
+        for name, settings, replica in configs:
+            env = {**os.environ, **base_env(workdir, primary_uri), **settings}
+            if not args.primary_uri:
+                primary = os.path.join(workdir, f"{name}.db")
+                shutil.copy(seeded, primary)
+                env["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{primary}"
+            if replica:
+                if args.replica_uri:
+                    env["SQLALCHEMY_REPLICA_URI"] = args.replica_uri
+                elif not args.primary_uri:
+                    shutil.copy(seeded, os.path.join(workdir, f"{name}-replica.db"))
+                    env["SQLALCHEMY_REPLICA_URI"] = f"sqlite:///{os.path.join(workdir, name + '-replica.db')}"
+                else:
+                    continue
+            output = subprocess.run(child + ["--run"], cwd=ROOT, env=env, check=True,
+                                    capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            result["opened"] = sum(result["opened"].values())
+            results.setdefault(name, []).append(result)
+
+    print(f"medians of {args.repeat} runs")
+    print(f"{'config':>14} {'requests':>9} {'errors':>7} {'conns opened':>13} {'db p50 ms':>10} "
+          f"{'db p99 ms':>10} {'req p99 ms':>11}  queries (last run)")
+    for name, runs in results.items():
+        median = {key: statistics.median(run[key] for run in runs)
+                  for key in ["requests", "errors", "opened", "db_p50_ms", "db_p99_ms", "request_p99_ms"]}
+        print(f"{name:>14} {median['requests']:>9.0f} {median['errors']:>7.0f} {median['opened']:>13.0f} "
+              f"{median['db_p50_ms']:>10.2f} {median['db_p99_ms']:>10.2f} {median['request_p99_ms']:>11.2f}  "
+              f"{runs[-1]['queries']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Concurrent /chat streams one worker sustains: sync gunicorn (app:app) versus the ASGI path (asgi:application).
+
+Both servers run a single worker against benchmarks.fake_openai, so the upstream
+is slow but never the bottleneck. Every request asks a distinct question so the
+answer cache never short-circuits a stream.
+
+    python -m benchmarks.bench_streams --concurrency 1 10 50 200 --tokens 40 --token-rate 20
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+import uuid
+
+import httpx
+
+from benchmarks.harness import app_env, free_port, login, percentile, start_app, start_fake_openai, stop
+
+
+async def one_stream(client, results):
+    started = time.perf_counter()
+    first = None
+    async with client.stream("POST", "/chat", json={"message": f"question {uuid.uuid4()}"}) as response:
+        response.raise_for_status()
+        async for _ in response.aiter_bytes():
+            if first is None:
+                first = time.perf_counter()
+    results.append((started, first, time.perf_counter()))
+
+
+def peak_overlap(results):
+    """Largest number of streams that were producing tokens at the same moment."""
+    events = sorted([(first, 1) for _, first, _ in results] + [(end, -1) for _, _, end in results])
+    active = peak = 0
+    for _, change in events:
+        active += change
+        peak = max(peak, active)
+    return peak
+
+
+async def run(base_url, cookies, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, timeout=600, limits=limits) as client:
+        results = []
+        started = time.perf_counter()
+        await asyncio.gather(*(one_stream(client, results) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    ttft = [first - start for start, first, _ in results]
+    return {
+        "wall_s": wall,
+        "peak_streams": peak_overlap(results),
+        "ttft_p50_ms": percentile(ttft, 50) * 1000,
+        "ttft_p95_ms": percentile(ttft, 95) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-rate", type=float, default=20.0)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--servers", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    args = parser.parse_args()
+
+    fake, openai_url = start_fake_openai(args.tokens, args.token_rate, args.latency)
+    try:
+        print(f"{'server':>6} {'streams':>8} {'peak':>6} {'wall s':>8} {'ttft p50 ms':>12} {'ttft p95 ms':>12}")
+        for server in args.servers:
+            with tempfile.TemporaryDirectory() as workdir:
+                port = free_port()
+                process = start_app(server, port, app_env(workdir, openai_url))
+                try:
+                    base_url = f"http://127.0.0.1:{port}"
+                    cookies = login(base_url)
+                    for concurrency in args.concurrency:
+                        r = asyncio.run(run(base_url, cookies, concurrency))
+                        print(f"{server:>6} {concurrency:>8} {r['peak_streams']:>6} {r['wall_s']:>8.2f} "
+                              f"{r['ttft_p50_ms']:>12.0f} {r['ttft_p95_ms']:>12.0f}")
+                finally:
+                    stop(process)
+    finally:
+        stop(fake)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Local stand-in for the OpenAI chat completions API, streaming at a fixed token rate.
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+    python -m benchmarks.fake_openai --port 8001 --tokens 40 --token-rate 50 --latency 0.3
+
+With --capacity N, streams past the N-th running at once share the token rate, like
+an upstream that is saturated. With --prefill-rate R, the first token also waits for
+the prompt to be read at R tokens per second (counted roughly, 4 characters a token),
+so time to first token grows with prompt size as it does upstream.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+async def _read_request(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    method, path, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, body
+
+
+def _event(model, content=None, finish_reason=None):
+    delta = {"content": content} if content is not None else {}
+    chunk = {
+        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+
+def _chunk(data):
+    return b"%x\r\n%s\r\n" % (len(data), data)
+
+
+def _prompt_tokens(request):
+    return sum(len(message.get("content") or "") for message in request.get("messages", [])) // 4
+
+
+def make_handler(tokens, token_rate, latency, capacity=0, prefill_rate=0):
+    in_flight = 0
+
+    async def handle(reader, writer):
+        nonlocal in_flight
+        try:
+            while True:
+                try:
+                    method, path, body = await _read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                if method != "POST" or not path.endswith("/chat/completions"):
+                    writer.write(b"HTTP/1.1 404 Not Found\r\ncontent-length: 0\r\n\r\n")
+                    await writer.drain()
+                    continue
+                request = json.loads(body or b"{}")
+                model = request.get("model", "fake")
+                writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\n"
+                             b"transfer-encoding: chunked\r\n\r\n")
+                in_flight += 1
+                try:
+                    prefill = _prompt_tokens(request) / prefill_rate if prefill_rate else 0
+                    await asyncio.sleep(latency + prefill)
+                    writer.write(_chunk(_event(model, "")))
+                    for i in range(tokens):
+                        writer.write(_chunk(_event(model, f"tok{i} ")))
+                        await writer.drain()
+                        slowdown = max(1.0, in_flight / capacity) if capacity else 1.0
+                        await asyncio.sleep(slowdown / token_rate)
+                finally:
+                    in_flight -= 1
+                writer.write(_chunk(_event(model, finish_reason="stop")))
+                writer.write(_chunk(b"data: [DONE]\n\n") + _chunk(b""))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(host, port, tokens, token_rate, latency, capacity=0, prefill_rate=0):
+    server = await asyncio.start_server(make_handler(tokens, token_rate, latency, capacity, prefill_rate),
+                                        host, port, backlog=1024)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per answer")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens per second per stream")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--capacity", type=int, default=0, help="streams served at full rate at once; 0 for no limit")
+    parser.add_argument("--prefill-rate", type=float, default=0, help="prompt tokens read per second; 0 for none")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.tokens, args.token_rate, args.latency, args.capacity,
+                      args.prefill_rate))
+
+
+if __name__ == "__main__":
+    main()
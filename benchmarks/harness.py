@@ -0,0 +1,107 @@
+"""Helpers for benchmarks that run the app and its fake services as subprocesses."""
+import os
+import sys
+import socket
+import subprocess
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERNAME = "loadtest"
+PASSWORD = "Loadtest1!"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port} after {timeout}s")
+
+
+def start(args, port, env=None):
+    process = subprocess.Popen(args, cwd=ROOT, env={**os.environ, **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def start_fake_openai(tokens, token_rate, latency, capacity=0, prefill_rate=0):
+    port = free_port()
+    process = start([sys.executable, "-m", "benchmarks.fake_openai", "--port", str(port), "--tokens", str(tokens),
+                     "--token-rate", str(token_rate), "--latency", str(latency), "--capacity", str(capacity),
+                     "--prefill-rate", str(prefill_rate)], port)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def app_env(workdir, openai_url, **extra):
+    """Environment for an app process that talks only to local fakes and keeps its state in workdir."""
+    return {
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": openai_url,
+        "PINECONE_API_KEY": "fake",
+        "SECRET_KEY": "loadtest",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(workdir, 'app.db')}",
+        "RATELIMIT_ENABLED": "false",
+        "VECTOR_STORE": "local",
+        "LOCAL_VECTOR_DIR": os.path.join(workdir, "vectors"),
+        "LEXICAL_INDEX_DIR": os.path.join(workdir, "lexical"),
+        "HISTORY_SPILL_DIR": os.path.join(workdir, "spill"),
+        # Admission control would refuse most of a load test's chats, which all come from one
+        # account; bench_admission turns it back on for the run it measures
+        "TOKEN_BUDGET": "0",
+        "UPSTREAM_MAX_CONCURRENCY": "0",
+        "ADMISSION_SQLITE_PATH": os.path.join(workdir, "admission.db"),
+        **extra,
+    }
+
+
+def start_app(server, port, env, workers=1):
+    """server is "sync" (gunicorn sync workers running app:app) or "async" (uvicorn workers running asgi:application)."""
+    args = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+            "--timeout", "300", "--keep-alive", "75"]
+    if server == "async":
+        args += ["--worker-class", "uvicorn_worker.UvicornWorker", "asgi:application"]
+    else:
+        args += ["app:app"]
+    return start(args, port, env)
+
+
+def login(base_url):
+    """Create the tables and a benchmark user; return the session cookies."""
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        client.get("/create_db")
+        client.post("/signup", data={"username": USERNAME, "password": PASSWORD})
+        client.post("/login", data={"username": USERNAME, "password": PASSWORD})
+        if "session" not in client.cookies:
+            raise RuntimeError("login failed")
+        return dict(client.cookies)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
@@ -0,0 +1,239 @@
+"""End-to-end load test of the app against local stand-ins for OpenAI and the vector index.
+
+Starts benchmarks.fake_openai and one app worker with VECTOR_STORE=fake. It uploads
+PDFs while virtual users send a mix of document chats, base-LLM chats, all-documents
+chats and history/PDF-list requests. Reports time to first token, streamed tokens/s,
+p50/p95/p99 latency per request type and ingestion pages/s. The results are written
+as JSON tagged with the current commit, so runs can be compared across commits:
+
+    python -m benchmarks.loadtest --users 50 --duration 30 --output benchmarks/results/loadtest.json
+    python -m benchmarks.loadtest --compare benchmarks/results/loadtest.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.harness import ROOT, app_env, free_port, login, percentile, start_app, start_fake_openai, stop
+from benchmarks.synthetic import WORDS, make_pdf
+
+# Relative weight of each kind of request a virtual user sends
+MIX = {"chat_pdf": 70, "chat_base": 10, "chat_all": 5, "history": 10, "pdfs": 5}
+
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(values, scale=1000.0):
+    if not values:
+        return None
+    return {"count": len(values), "p50": percentile(values, 50) * scale, "p95": percentile(values, 95) * scale,
+            "p99": percentile(values, 99) * scale, "max": max(values) * scale}
+
+
+class Recorder:
+    def __init__(self):
+        self.latency = {kind: [] for kind in MIX}
+        self.ttft = []
+        self.tokens_per_second = []
+        self.errors = {}
+
+    def error(self, kind, reason):
+        key = f"{kind}: {reason}"
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+async def chat(client, recorder, kind, message, namespace):
+    started = time.perf_counter()
+    first = None
+    tokens = 0
+    payload = {"message": message}
+    if namespace:
+        payload["namespace"] = namespace
+    async with client.stream("POST", "/chat", json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            recorder.error(kind, response.status_code)
+            return
+        async for text in response.aiter_text():
+            if first is None and text:
+                first = time.perf_counter()
+            tokens += len(text.split())
+    end = time.perf_counter()
+    recorder.latency[kind].append(end - started)
+    if first is not None:
+        recorder.ttft.append(first - started)
+        if end > first and tokens > 1:
+            recorder.tokens_per_second.append(tokens / (end - first))
+
+
+async def simple(client, recorder, kind, path):
+    started = time.perf_counter()
+    response = await client.get(path)
+    if response.status_code != 200:
+        recorder.error(kind, response.status_code)
+        return
+    recorder.latency[kind].append(time.perf_counter() - started)
+
+
+async def virtual_user(client, recorder, rng, deadline, namespaces, questions, think_time):
+    kinds = list(MIX)
+    weights = [MIX[kind] for kind in kinds]
+    while time.perf_counter() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        try:
+            if kind == "history":
+                await simple(client, recorder, kind, "/get_history")
+            elif kind == "pdfs":
+                await simple(client, recorder, kind, "/get_pdfs")
+            else:
+                namespace = {"chat_pdf": rng.choice(namespaces) if namespaces else None,
+                             "chat_base": None, "chat_all": "__all__"}[kind]
+                await chat(client, recorder, kind, questions(rng), namespace)
+        except httpx.HTTPError as e:
+            recorder.error(kind, type(e).__name__)
+        await asyncio.sleep(rng.expovariate(1 / think_time) if think_time else 0)
+
+
+async def ingest(client, name, pages, seed, results, namespaces):
+    data = make_pdf(pages, seed=seed)
+    started = time.perf_counter()
+    response = await client.post("/upload_pdf", files={"pdf": (f"{name}.pdf", data, "application/pdf")})
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        await asyncio.sleep(0.2)
+        status = (await client.get(f"/ingest_status/{job_id}")).json()
+        if status["stage"] in ("done", "failed"):
+            break
+    results.append({"name": name, "pages": pages, "seconds": time.perf_counter() - started, "stage": status["stage"]})
+    if status["stage"] == "done":
+        namespaces.append(name)
+
+
+def make_questions(repeat_ratio, pool_size=20, seed=1):
+    """Question generator: repeat_ratio of questions come from a small FAQ pool, the rest are unique."""
+    pool_rng = random.Random(seed)
+    pool = [" ".join(pool_rng.choices(WORDS[:30], k=6)) + "?" for _ in range(pool_size)]
+
+    def question(rng):
+        if rng.random() < repeat_ratio:
+            return rng.choice(pool)
+        return " ".join(rng.choices(WORDS[:30], k=6)) + f" E-{rng.randint(0, 99)}{rng.randint(100, 999)}?"
+    return question
+
+
+async def drive(base_url, cookies, args):
+    limits = httpx.Limits(max_connections=args.users + 8, max_keepalive_connections=args.users + 8)
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, timeout=300, limits=limits) as client:
+        # One document is indexed up front so document chats have something to hit from the start
+        ingestion = []
+        namespaces = []
+        await ingest(client, "warmup", args.pages, args.seed, ingestion, namespaces)
+
+        recorder = Recorder()
+        rng = random.Random(args.seed)
+        questions = make_questions(args.repeat_ratio)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        users = [virtual_user(client, recorder, random.Random(rng.random()), deadline, namespaces, questions,
+                              args.think_time) for _ in range(args.users)]
+        uploads = [ingest(client, f"doc{i}", args.pages, args.seed + i + 1, ingestion, namespaces)
+                   for i in range(args.uploads)]
+        await asyncio.gather(*users, *uploads)
+        elapsed = time.perf_counter() - started
+
+    requests = sum(len(values) for values in recorder.latency.values())
+    ingested = [job for job in ingestion if job["stage"] == "done"]
+    return {
+        "requests": requests,
+        "requests_per_second": requests / elapsed,
+        "errors": recorder.errors,
+        "ttft_ms": summarize(recorder.ttft),
+        "tokens_per_second": summarize(recorder.tokens_per_second, scale=1.0),
+        "latency_ms": {kind: summarize(values) for kind, values in recorder.latency.items()},
+        "ingestion": {
+            "jobs": len(ingestion),
+            "failed": len(ingestion) - len(ingested),
+            "pages_per_second": (sum(job["pages"] for job in ingested) / sum(job["seconds"] for job in ingested)
+                                 if ingested else None),
+        },
+    }
+
+
+def compare(current, baseline):
+    rows = [("requests/s", baseline["requests_per_second"], current["requests_per_second"])]
+    for name in ("ttft_ms",):
+        if baseline[name] and current[name]:
+            rows += [(f"{name} p50", baseline[name]["p50"], current[name]["p50"]),
+                     (f"{name} p99", baseline[name]["p99"], current[name]["p99"])]
+    for kind in MIX:
+        b, c = baseline["latency_ms"].get(kind), current["latency_ms"].get(kind)
+        if b and c:
+            rows.append((f"{kind} p95 ms", b["p95"], c["p95"]))
+    rows.append(("ingest pages/s", baseline["ingestion"]["pages_per_second"], current["ingestion"]["pages_per_second"]))
+    print(f"{'metric':<22} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, b, c in rows:
+        if b is None or c is None:
+            continue
+        print(f"{name:<22} {b:>10.1f} {c:>10.1f} {(c - b) / b * 100 if b else 0:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=["sync", "async"], default="async")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of chat traffic")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean seconds between a user's requests")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="share of questions drawn from an FAQ pool")
+    parser.add_argument("--uploads", type=int, default=3, help="PDFs uploaded during the run")
+    parser.add_argument("--pages", type=int, default=40, help="pages per uploaded PDF")
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per fake answer")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="fake tokens per second per stream")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake seconds before the first token")
+    parser.add_argument("--index-latency", type=float, default=0.02, help="fake vector index round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run to compare against")
+    args = parser.parse_args()
+
+    fake, openai_url = start_fake_openai(args.tokens, args.token_rate, args.latency)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            env = app_env(workdir, openai_url, VECTOR_STORE="fake", FAKE_INDEX_LATENCY=str(args.index_latency))
+            process = start_app(args.server, port, env)
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                results = asyncio.run(drive(base_url, login(base_url), args))
+            finally:
+                stop(process)
+    finally:
+        stop(fake)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    report = {"commit": commit(), "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+              "config": config, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import random
+
+WORDS = (
+    "pump valve pressure sensor firmware reset calibration warranty clause torque bearing "
+    "install manual safety voltage circuit relay fault code module housing seal filter "
+    "the a of and to in for with on is be by this that from at as are"
+).split()
+
+
+def make_sentence(rng, page):
+    words = rng.choices(WORDS, k=rng.randint(8, 18))
+    words.insert(rng.randrange(len(words)), f"E-{page}{rng.randint(100, 999)}")
+    return " ".join(words).capitalize() + "."
+
+
+def make_page_text(rng, page, paragraphs=6):
+    """Plain text of one page: several paragraphs of three to nine sentences."""
+    return "\n\n".join(
+        " ".join(make_sentence(rng, page) for _ in range(rng.randint(3, 9)))
+        for _ in range(paragraphs)
+    )
+
+
+def make_pdf(num_pages, lines_per_page=45, seed=0):
+    """Build an uncompressed multi-page PDF with pseudo-random technical prose on every page."""
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(num_pages):
+        lines = [make_sentence(rng, page)[:95] for _ in range(lines_per_page)]
+        body = "BT /F1 9 Tf 12 TL 36 806 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(body)} >>\nstream\n{body}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {num_pages} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
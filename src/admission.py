@@ -0,0 +1,361 @@
+import os
+import time
+import uuid
+import logging
+import sqlite3
+import tempfile
+import threading
+from dotenv import load_dotenv
+from src.context import count_tokens, CONTEXT_TOKEN_BUDGET
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Each /chat is charged against a per-user token bucket that holds at most TOKEN_BUDGET tokens
+# and refills from empty in TOKEN_BUDGET_WINDOW seconds. 0 turns the budget off.
+TOKEN_BUDGET = int(os.getenv("TOKEN_BUDGET", 100000))
+TOKEN_BUDGET_WINDOW = float(os.getenv("TOKEN_BUDGET_WINDOW", 3600))
+# Charged up front for the answer; the difference from the real prompt and answer is settled when it ends
+OUTPUT_TOKEN_RESERVE = int(os.getenv("OUTPUT_TOKEN_RESERVE", 500))
+# Streams allowed against OpenAI at once across every process sharing the backend; beyond this
+# /chat is refused at once instead of queueing behind them. 0 turns the limit off.
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", 64))
+# A slot still held after this long (its worker died mid-stream) is given to someone else
+UPSTREAM_SLOT_TTL = float(os.getenv("UPSTREAM_SLOT_TTL", 300))
+# Where budgets and slots live: "sqlite" (processes on one host), "redis" (any Redis-compatible
+# server; needs the redis package) or "memory" (this process only, so every gunicorn worker
+# would hand out the whole budget and concurrency on its own)
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "sqlite")
+# Outside the working tree, so runs started from a checkout don't leave it (and its -wal/-shm files) there
+ADMISSION_SQLITE_PATH = os.getenv("ADMISSION_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "rag-chatbot-admission.db"))
+# Seconds to wait for another process's write lock before /chat is refused as busy
+ADMISSION_SQLITE_TIMEOUT = float(os.getenv("ADMISSION_SQLITE_TIMEOUT", 1))
+ADMISSION_REDIS_URL = os.getenv("ADMISSION_REDIS_URL", "redis://localhost:6379/0")
+
+SLOTS_KEY = "upstream"
+
+
+class AdmissionBackend:
+    """Token buckets and concurrency slots, shared by every process using the same backend."""
+
+    # Exceptions meaning the backend could not answer in time; admit() turns them into a busy refusal
+    errors = ()
+
+    def take(self, key, cost, capacity, rate, force=False):
+        """Refill key's bucket at rate tokens/s up to capacity, then take cost tokens from it.
+
+        Without force, nothing is taken if the bucket holds less than cost. A negative
+        cost gives tokens back. Returns (taken, tokens left).
+        """
+        raise NotImplementedError
+
+    def acquire(self, key, limit, ttl):
+        """Take one of limit slots for ttl seconds; returns a slot id, or None if all are taken."""
+        raise NotImplementedError
+
+    def release(self, key, slot):
+        raise NotImplementedError
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    if tokens is None:
+        return capacity
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryBackend(AdmissionBackend):
+    def __init__(self):
+        self._buckets = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, capacity, rate, force=False):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (None, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            taken = force or tokens >= cost
+            if taken:
+                tokens = min(capacity, tokens - cost)
+            self._buckets[key] = (tokens, now)
+        return taken, tokens
+
+    def acquire(self, key, limit, ttl):
+        now = time.time()
+        with self._lock:
+            slots = self._slots.setdefault(key, {})
+            for slot in [slot for slot, expires in slots.items() if expires <= now]:
+                del slots[slot]
+            if len(slots) >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            slots[slot] = now + ttl
+        return slot
+
+    def release(self, key, slot):
+        with self._lock:
+            self._slots.get(key, {}).pop(slot, None)
+
+
+class SQLiteBackend(AdmissionBackend):
+    """Backend in a SQLite file, for gunicorn workers on one host."""
+
+    errors = (sqlite3.Error,)
+
+    def __init__(self, path=ADMISSION_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS slots (key TEXT, slot TEXT PRIMARY KEY, expires REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_slots_key ON slots (key, expires)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=ADMISSION_SQLITE_TIMEOUT,
+                                                              isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _transaction(self):
+        conn = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        return _Transaction(conn)
+
+    def take(self, key, cost, capacity, rate, force=False):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = _refill(*(row or (None, now)), now, capacity, rate)
+            taken = force or tokens >= cost
+            if taken:
+                tokens = min(capacity, tokens - cost)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+        return taken, tokens
+
+    def acquire(self, key, limit, ttl):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE key = ? AND expires <= ?", (key, now))
+            if conn.execute("SELECT count(*) FROM slots WHERE key = ?", (key,)).fetchone()[0] >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            conn.execute("INSERT INTO slots (key, slot, expires) VALUES (?, ?, ?)", (key, slot, now + ttl))
+        return slot
+
+    def release(self, key, slot):
+        self._connection().execute("DELETE FROM slots WHERE slot = ?", (slot,))
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+_TAKE_SCRIPT = """
+local cost, capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = capacity
+if bucket[1] then
+    tokens = math.min(capacity, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+end
+local taken = 0
+if ARGV[5] == '1' or tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+    taken = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return {taken, tostring(tokens)}
+"""
+
+_ACQUIRE_SCRIPT = """
+local now, ttl, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[4])
+return 1
+"""
+
+
+class RedisBackend(AdmissionBackend):
+    """Backend on a Redis-compatible server, for workers on several hosts.
+
+    Each operation is a single Lua script, so it is atomic on the server.
+    """
+
+    def __init__(self, url=ADMISSION_REDIS_URL, prefix="admission:"):
+        import redis
+        self.errors = (redis.RedisError,)
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.redis.register_script(_TAKE_SCRIPT)
+        self._acquire = self.redis.register_script(_ACQUIRE_SCRIPT)
+
+    def take(self, key, cost, capacity, rate, force=False):
+        # Buckets idle long enough to be full again carry no information
+        expire = int(capacity / rate) + 1 if rate else 86400
+        taken, tokens = self._take(keys=[self.prefix + key],
+                                   args=[cost, capacity, rate, time.time(), int(force), expire])
+        return bool(taken), float(tokens)
+
+    def acquire(self, key, limit, ttl):
+        slot = uuid.uuid4().hex
+        if self._acquire(keys=[self.prefix + key], args=[time.time(), ttl, limit, slot]):
+            return slot
+        return None
+
+    def release(self, key, slot):
+        self.redis.zrem(self.prefix + key, slot)
+
+
+_BACKENDS = {
+    "memory": MemoryBackend,
+    "sqlite": SQLiteBackend,
+    "redis": RedisBackend,
+}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class Ticket:
+    """An admitted /chat. settle() must be called once the answer ends, however it ends."""
+
+    def __init__(self, control, user_id, prompt_tokens, slot, charged=0):
+        self.control = control
+        self.user_id = user_id
+        self.prompt_tokens = prompt_tokens
+        self.slot = slot
+        # Tokens taken from the budget at admission
+        self.charged = charged
+        # The prompt actually sent, once it is built; until then the estimate stands in for it
+        self.sent_prompt_tokens = None
+        self._settled = False
+
+    def prompt_sent(self, tokens):
+        """Record the size of the prompt sent upstream; pass as on_prompt to answer_query_stream."""
+        self.sent_prompt_tokens = tokens
+
+    def settle(self, answer):
+        if self._settled:
+            return
+        self._settled = True
+        self.control.settle(self, count_tokens(answer))
+
+
+class AdmissionControl:
+    """Decides whether a /chat may start, from the user's token budget and upstream concurrency."""
+
+    def __init__(self, backend=None, budget=TOKEN_BUDGET, window=TOKEN_BUDGET_WINDOW,
+                 max_concurrency=UPSTREAM_MAX_CONCURRENCY, slot_ttl=UPSTREAM_SLOT_TTL):
+        self._backend = backend
+        self.budget = budget
+        self.rate = budget / window if window else 0
+        self.max_concurrency = max_concurrency
+        self.slot_ttl = slot_ttl
+        self.counts = {"admitted": 0, "over_budget": 0, "busy": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    if ADMISSION_BACKEND not in _BACKENDS:
+                        raise ValueError(f"Unknown ADMISSION_BACKEND '{ADMISSION_BACKEND}', "
+                                         f"expected one of {sorted(_BACKENDS)}")
+                    self._backend = _BACKENDS[ADMISSION_BACKEND]()
+        return self._backend
+
+    def estimate_prompt(self, message, history, retrieves=False):
+        """Prompt tokens for a chat before retrieval runs.
+
+        Chats that search documents are charged their context at its full budget;
+        settle() gives back whatever retrieval did not use.
+        """
+        tokens = count_tokens(message) + sum(count_tokens(turn["content"]) for turn in history)
+        return tokens + CONTEXT_TOKEN_BUDGET if retrieves else tokens
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def admit(self, user_id, prompt_tokens):
+        """Return a Ticket for the chat, or raise AdmissionRejected."""
+        backend = self.backend
+        try:
+            return self._admit(backend, user_id, prompt_tokens)
+        except backend.errors:
+            # A locked or unreachable backend refuses quickly instead of failing the request
+            logger.warning("Admission backend %s failed, refusing chat", ADMISSION_BACKEND, exc_info=True)
+            self._count("busy")
+            raise AdmissionRejected("The assistant is busy, please try again in a moment.", 1)
+
+    def _admit(self, backend, user_id, prompt_tokens):
+        slot = None
+        cost = 0
+        if self.max_concurrency:
+            slot = backend.acquire(SLOTS_KEY, self.max_concurrency, self.slot_ttl)
+            if slot is None:
+                self._count("busy")
+                raise AdmissionRejected("The assistant is busy, please try again in a moment.", 1)
+        if self.budget:
+            # A chat bigger than the whole budget is let through once the bucket is full
+            cost = min(prompt_tokens + OUTPUT_TOKEN_RESERVE, self.budget)
+            try:
+                taken, tokens = backend.take(f"user:{user_id}", cost, self.budget, self.rate)
+            except backend.errors:
+                self._release(backend, slot)
+                raise
+            if not taken:
+                self._release(backend, slot)
+                self._count("over_budget")
+                raise AdmissionRejected("You have used your token budget for now, please try again later.",
+                                        (cost - tokens) / self.rate if self.rate else 3600)
+        self._count("admitted")
+        return Ticket(self, user_id, prompt_tokens, slot, cost)
+
+    @staticmethod
+    def _release(backend, slot):
+        if not slot:
+            return
+        try:
+            backend.release(SLOTS_KEY, slot)
+        except backend.errors:
+            # Left to expire after UPSTREAM_SLOT_TTL
+            logger.warning("Could not release upstream slot %s", slot, exc_info=True)
+
+    def settle(self, ticket, answer_tokens):
+        try:
+            if self.budget:
+                # Charge the real prompt and answer in place of what admit() took; the bucket may go below zero
+                prompt_tokens = ticket.prompt_tokens if ticket.sent_prompt_tokens is None else ticket.sent_prompt_tokens
+                self.backend.take(f"user:{ticket.user_id}", prompt_tokens + answer_tokens - ticket.charged,
+                                  self.budget, self.rate, force=True)
+        finally:
+            if ticket.slot:
+                self.backend.release(SLOTS_KEY, ticket.slot)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, backend=ADMISSION_BACKEND)
+
+
+admission = AdmissionControl()
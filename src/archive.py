@@ -0,0 +1,149 @@
+import os
+import json
+import zlib
+import heapq
+import logging
+from datetime import datetime, timedelta
+from itertools import groupby
+from sqlalchemy import and_, or_
+from src.models import db, ChatHistory, ChatHistoryArchive
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Turns newer than this stay in the ChatHistory table; older ones are moved to the archive
+HISTORY_HOT_DAYS = int(os.getenv("HISTORY_HOT_DAYS", 30))
+# Hot rows moved per transaction while archiving
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", 5000))
+DELETE_BATCH = 500
+
+
+def _key(row):
+    return row["timestamp"], row["id"]
+
+
+def _pack(rows):
+    payload = [[row["id"], row["timestamp"].isoformat(), row["user_message"], row["bot_response"]] for row in rows]
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(data):
+    return [{"id": chat_id, "timestamp": datetime.fromisoformat(timestamp),
+             "user_message": user_message, "bot_response": bot_response}
+            for chat_id, timestamp, user_message, bot_response in json.loads(zlib.decompress(data))]
+
+
+def _hot_row(row):
+    return {"id": row.id, "timestamp": row.timestamp, "user_message": row.user_message,
+            "bot_response": row.bot_response}
+
+
+_HOT_COLUMNS = (ChatHistory.id, ChatHistory.timestamp, ChatHistory.user_message, ChatHistory.bot_response)
+
+
+def archive_history(cutoff=None, batch_rows=ARCHIVE_BATCH_ROWS):
+    """Move ChatHistory rows older than cutoff into per-user, per-day compressed blobs.
+
+    Every batch inserts its blobs and deletes the rows it packed in one transaction,
+    so a crash mid-run never loses or duplicates a turn. Returns (rows moved, blobs written).
+    """
+    cutoff = cutoff or datetime.utcnow() - timedelta(days=HISTORY_HOT_DAYS)
+    moved = blobs = 0
+    while True:
+        rows = db.session.execute(
+            db.select(ChatHistory.user_id, *_HOT_COLUMNS)
+            .where(ChatHistory.timestamp < cutoff)
+            .order_by(ChatHistory.user_id, ChatHistory.timestamp, ChatHistory.id)
+            .limit(batch_rows)
+        ).all()
+        if not rows:
+            break
+        for (user_id, day), group in groupby(rows, key=lambda row: (row.user_id, row.timestamp.date())):
+            group = [_hot_row(row) for row in group]
+            db.session.add(ChatHistoryArchive(
+                user_id=user_id, day=day,
+                first_timestamp=group[0]["timestamp"], first_id=group[0]["id"],
+                last_timestamp=group[-1]["timestamp"], last_id=group[-1]["id"],
+                rows=len(group), data=_pack(group),
+            ))
+            blobs += 1
+        ids = [row.id for row in rows]
+        for start in range(0, len(ids), DELETE_BATCH):
+            db.session.execute(db.delete(ChatHistory).where(ChatHistory.id.in_(ids[start:start + DELETE_BATCH])))
+        db.session.commit()
+        moved += len(rows)
+        logger.info("Archived %d chat turns so far", moved)
+    return moved, blobs
+
+
+def _before(columns, before):
+    timestamp_column, id_column = columns
+    timestamp, chat_id = before
+    return or_(timestamp_column < timestamp, and_(timestamp_column == timestamp, id_column < chat_id))
+
+
+def _archived_page(user_id, before, limit):
+    """Up to limit archived turns of user_id older than before, newest first."""
+    query = ChatHistoryArchive.query.filter_by(user_id=user_id)
+    if before:
+        query = query.filter(_before((ChatHistoryArchive.first_timestamp, ChatHistoryArchive.first_id), before))
+    rows = []
+    for blob in query.order_by(ChatHistoryArchive.last_timestamp.desc(), ChatHistoryArchive.last_id.desc()).yield_per(16):
+        # Blobs come newest last-row first, so once one ends before the limit-th row found so far, none can add to the page
+        if len(rows) >= limit and (blob.last_timestamp, blob.last_id) < _key(rows[limit - 1]):
+            break
+        rows.extend(row for row in _unpack(blob.data) if before is None or _key(row) < before)
+        rows.sort(key=_key, reverse=True)
+        del rows[limit:]
+    return rows
+
+
+def history_page(user_id, before=None, limit=50):
+    """Up to limit turns of user_id older than the (timestamp, id) cursor before, newest first, from both tiers.
+
+    The archive is only read when the hot table runs out of turns for the page.
+    """
+    query = db.select(*_HOT_COLUMNS).where(ChatHistory.user_id == user_id)
+    if before:
+        query = query.where(_before((ChatHistory.timestamp, ChatHistory.id), before))
+    rows = [_hot_row(row) for row in db.session.execute(
+        query.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit)
+    )]
+    if len(rows) < limit:
+        rows = sorted(rows + _archived_page(user_id, before, limit), key=_key, reverse=True)[:limit]
+    return rows
+
+
+def _iter_archived(user_id):
+    # Blobs ordered by their first row may still overlap, so rows wait in a heap until no later blob can precede them
+    heap = []
+    query = (ChatHistoryArchive.query.filter_by(user_id=user_id)
+             .order_by(ChatHistoryArchive.first_timestamp, ChatHistoryArchive.first_id).yield_per(16))
+    for blob in query:
+        while heap and heap[0][0] < (blob.first_timestamp, blob.first_id):
+            yield heapq.heappop(heap)[1]
+        for row in _unpack(blob.data):
+            heapq.heappush(heap, (_key(row), row))
+    while heap:
+        yield heapq.heappop(heap)[1]
+
+
+def iter_history(user_id, batch=500):
+    """Every turn of user_id, oldest first, from both tiers, without loading them all at once."""
+    hot = (_hot_row(row) for row in db.session.execute(
+        db.select(*_HOT_COLUMNS).where(ChatHistory.user_id == user_id)
+        .order_by(ChatHistory.timestamp, ChatHistory.id)
+        .execution_options(yield_per=batch)
+    ))
+    return heapq.merge(_iter_archived(user_id), hot, key=_key)
+
+
+def tier_stats():
+    hot = db.session.query(db.func.count(ChatHistory.id)).scalar()
+    blobs, archived, archived_bytes = db.session.query(
+        db.func.count(ChatHistoryArchive.id), db.func.sum(ChatHistoryArchive.rows),
+        db.func.sum(db.func.length(ChatHistoryArchive.data))).one()
+    return {"hot_rows": hot, "archived_rows": archived or 0, "archive_blobs": blobs,
+            "archive_bytes": archived_bytes or 0}
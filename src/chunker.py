@@ -0,0 +1,137 @@
+import os
+import re
+import logging
+import tiktoken
+from langchain.schema import Document
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 200))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 12))
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"(?<=[.!?:;])\s+")
+# Pieces that roughly match cl100k_base tokens on English text: a word with its leading
+# space, up to three digits, a run of punctuation, whitespace
+_PIECES = re.compile(r" ?[^\W\d_]+| ?\d{1,3}| ?[^\w\s]+|\s+|_+")
+_encoding = None
+
+
+class ApproximateEncoding:
+    """Offline stand-in for a tiktoken encoding whose tokens are the text pieces themselves.
+
+    Counts are close to cl100k_base for English prose and lower for rare words and code.
+    """
+
+    def encode_ordinary(self, text):
+        return _PIECES.findall(text)
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def get_encoding():
+    # tiktoken downloads the cl100k_base BPE file on first use unless it is already in
+    # TIKTOKEN_CACHE_DIR. Without network access the local and fake vector stores, which
+    # exist to run the whole app on one box, fall back to approximate counts.
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            if os.getenv("VECTOR_STORE", "pinecone") not in ("local", "fake"):
+                raise
+            logger.warning("Could not load cl100k_base, counting tokens approximately", exc_info=True)
+            _encoding = ApproximateEncoding()
+    return _encoding
+
+
+def _split_units(text, chunk_tokens):
+    """Break text into sentences as (text, tokens, paragraph_start) units.
+
+    Sentences longer than a whole chunk are cut into chunk-sized token windows.
+    """
+    sentences = []
+    starts = []
+    for paragraph in _PARAGRAPH.split(text):
+        parts = [part for part in _SENTENCE.split(paragraph.strip()) if part]
+        sentences.extend(parts)
+        starts.extend([True] + [False] * (len(parts) - 1))
+    if not sentences:
+        return []
+
+    encoding = get_encoding()
+    units = []
+    for sentence, tokens, start in zip(sentences, encoding.encode_ordinary_batch(sentences), starts):
+        if len(tokens) <= chunk_tokens:
+            units.append((sentence, len(tokens), start))
+            continue
+        for i in range(0, len(tokens), chunk_tokens):
+            piece = tokens[i:i+chunk_tokens]
+            units.append((encoding.decode(piece), len(piece), start and i == 0))
+    return units
+
+
+def _join(units):
+    parts = []
+    for i, (text, _, start) in enumerate(units):
+        if i:
+            parts.append("\n\n" if start else " ")
+        parts.append(text)
+    return "".join(parts)
+
+
+def split_text(text, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Yield (chunk_text, token_count) pairs of at most chunk_tokens tokens.
+
+    Chunks end on sentence boundaries. A chunk that is at least half full also ends at a
+    paragraph break when the next paragraph would not fit. Chunks cut mid-paragraph
+    repeat up to overlap_tokens of trailing sentences at the start of the next chunk.
+    Token counts are the sum of per-sentence counts, which can differ by a token or two
+    from encoding the joined text.
+    """
+    units = _split_units(text, chunk_tokens)
+
+    # Tokens from each paragraph-start unit to the end of its paragraph
+    paragraph_tokens = [0] * len(units)
+    remaining = 0
+    for i in range(len(units) - 1, -1, -1):
+        remaining += units[i][1]
+        if units[i][2]:
+            paragraph_tokens[i] = remaining
+            remaining = 0
+
+    current = []
+    size = 0
+    for i, unit in enumerate(units):
+        count = unit[1]
+        at_paragraph = unit[2] and size >= chunk_tokens // 2 and size + paragraph_tokens[i] > chunk_tokens
+        if current and (size + count > chunk_tokens or at_paragraph):
+            yield _join(current), size
+            kept = []
+            kept_size = 0
+            if not unit[2]:
+                for previous in reversed(current):
+                    if kept_size + previous[1] > overlap_tokens or kept_size + previous[1] + count > chunk_tokens:
+                        break
+                    kept.append(previous)
+                    kept_size += previous[1]
+            current = kept[::-1]
+            size = kept_size
+        current.append(unit)
+        size += count
+
+    if current:
+        yield _join(current), size
+
+
+def iter_token_chunks(pages, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    for page in pages:
+        for text, token_count in split_text(page.page_content, chunk_tokens, overlap_tokens):
+            yield Document(page_content=text, metadata={**page.metadata, "token_count": token_count})
@@ -0,0 +1,93 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+from src.chunker import get_encoding
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Maximum tokens of retrieved context placed in a prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+# A chunk that doesn't fit is trimmed to the remaining budget only if at least this many tokens remain
+MIN_TRIM_TOKENS = 64
+SEPARATOR = "\n\n"
+
+
+def count_tokens(text):
+    return len(get_encoding().encode_ordinary(text))
+
+
+def _doc_tokens(doc):
+    # Counts are stored with each chunk at ingestion; older records fall back to counting here
+    cached = doc.metadata.get("token_count")
+    return cached if cached is not None else count_tokens(doc.page_content)
+
+
+def pack_context(docs, budget=CONTEXT_TOKEN_BUDGET, label=None):
+    """Join docs into at most budget tokens of context, best first.
+
+    Docs are taken in the order given, which is retrieval's fused and diversified rank,
+    so lexical-only hits (dense score 0) are not pushed to the back. One that doesn't
+    fit is cut to the remaining budget if that leaves at least MIN_TRIM_TOKENS,
+    otherwise it is dropped. label(doc), if given, returns a prefix for each chunk such
+    as its source namespace. Returns (context, context_tokens, docs_used).
+    """
+    encoding = get_encoding()
+    separator_tokens = count_tokens(SEPARATOR)
+
+    parts = []
+    used = 0
+    for doc in docs:
+        prefix = label(doc) if label else ""
+        overhead = (separator_tokens if parts else 0) + (count_tokens(prefix) if prefix else 0)
+        remaining = budget - used - overhead
+        tokens = _doc_tokens(doc)
+        text = doc.page_content
+        if tokens > remaining:
+            if remaining < MIN_TRIM_TOKENS:
+                continue
+            text = encoding.decode(encoding.encode_ordinary(text)[:remaining])
+            tokens = remaining
+        parts.append(prefix + text)
+        used += overhead + tokens
+    return SEPARATOR.join(parts), used, len(parts)
+
+
+class PromptStats:
+    """Running prompt-size figures for this process."""
+
+    def __init__(self):
+        self.requests = 0
+        self.total = 0
+        self.largest = 0
+        self.last = 0
+        self._lock = threading.Lock()
+
+    def record(self, tokens):
+        with self._lock:
+            self.requests += 1
+            self.total += tokens
+            self.largest = max(self.largest, tokens)
+            self.last = tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "mean": round(self.total / self.requests, 1) if self.requests else 0.0,
+                "max": self.largest,
+                "last": self.last,
+            }
+
+
+prompt_stats = PromptStats()
+
+
+def record_prompt(messages, context_tokens=0, chunks=0):
+    # Each chat message carries about 4 tokens of framing on top of its content
+    tokens = sum(count_tokens(message["content"]) + 4 for message in messages)
+    prompt_stats.record(tokens)
+    logger.info("Prompt tokens: %d (context %d tokens from %d chunks)", tokens, context_tokens, chunks)
+    return tokens
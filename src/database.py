@@ -0,0 +1,121 @@
+import os
+import threading
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Per-process pool for each engine. Every gunicorn worker has its own pool, so the app can
+# hold up to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections per database: 40 for four
+# workers with the defaults, against Postgres' default max_connections of 100 shared with
+# every other client. Request threads, the ingest pool, the history writer, memory summaries
+# and the threads behind the ASGI /chat all check out connections, so a busy worker can want
+# more than WSGI_THREADS; raise these only if the server has connections to spare.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+# Connections opened past the pool size are closed as soon as they are returned, so a
+# large overflow under steady load means a connect and disconnect per request
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Connections older than this are replaced, staying under server and proxy idle timeouts
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Views wrapped in replica_reads send their SELECTs here when it is set
+SQLALCHEMY_REPLICA_URI = os.getenv("SQLALCHEMY_REPLICA_URI")
+
+REPLICA_BIND = "replica"
+
+
+def engine_options(uri):
+    """Pool settings for an engine connecting to uri."""
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite shares a single connection (StaticPool) and takes no pool settings
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def configure_database(app):
+    """Set engine options and the replica bind on app; call before db.init_app(app)."""
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if uri:
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(uri))
+    if SQLALCHEMY_REPLICA_URI:
+        app.config.setdefault("SQLALCHEMY_BINDS", {})[REPLICA_BIND] = {
+            "url": SQLALCHEMY_REPLICA_URI, **engine_options(SQLALCHEMY_REPLICA_URI)}
+
+
+class RoutingSession(Session):
+    """Session that sends reads to the replica inside views wrapped in replica_reads.
+
+    Flushes, INSERT/UPDATE/DELETE statements and everything outside those views use
+    the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context() and g.get("db_replica")
+                and REPLICA_BIND in self._db.engines and not getattr(clause, "is_dml", False)):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_reads(view):
+    """Let view read from the replica. Replicas lag, so only wrap views that can show slightly stale data."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def use_primary():
+    """Read from the primary for the rest of this request, e.g. right after writing."""
+    g.db_replica = False
+
+
+class PoolStats:
+    """Connections opened and checked out, per bind."""
+
+    def __init__(self):
+        self._opened = {}
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def watch(self, engines):
+        for name, engine in engines.items():
+            name = name or "primary"
+            self._engines[name] = engine
+            self._opened.setdefault(name, 0)
+            event.listen(engine, "connect", lambda *_, name=name: self._connected(name))
+
+    def _connected(self, name):
+        with self._lock:
+            self._opened[name] += 1
+
+    def stats(self):
+        with self._lock:
+            opened = dict(self._opened)
+        return {name: {"opened": opened[name], "status": engine.pool.status()}
+                for name, engine in self._engines.items()}
+
+
+pool_stats = PoolStats()
+
+
+def init_pools(app, db):
+    """Count connections on app's engines and drop inherited connections in forked children."""
+    with app.app_context():
+        engines = dict(db.engines)
+    pool_stats.watch(engines)
+    # A worker forked from a process that already connected (gunicorn --preload) must not
+    # reuse the parent's sockets; close=False leaves them open for the parent
+    os.register_at_fork(after_in_child=lambda: [engine.dispose(close=False) for engine in engines.values()])
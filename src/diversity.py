@@ -0,0 +1,60 @@
+import os
+import re
+import zlib
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Trade-off between relevance (1.0) and novelty (0.0) in maximal marginal relevance
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+# Candidates at least this similar to an already selected chunk are dropped as near-duplicates
+DUPLICATE_THRESHOLD = float(os.getenv("MMR_DUPLICATE_THRESHOLD", 0.9))
+SIGNATURE_DIM = 2048
+SHINGLE_WORDS = 3
+
+
+def shingle_signatures(texts, dim=SIGNATURE_DIM, size=SHINGLE_WORDS):
+    """L2-normalised bit vectors of hashed word shingles, one row per text.
+
+    The dot product of two rows approximates the cosine similarity of their shingle
+    sets, which is high for repeated headers, boilerplate and overlapping chunks.
+    """
+    signatures = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = re.findall(r"\w+", text.lower())
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        buckets = [zlib.crc32(shingle.encode("utf-8")) % dim for shingle in shingles if shingle]
+        signatures[row, buckets] = 1.0
+    norms = np.linalg.norm(signatures, axis=1, keepdims=True)
+    np.divide(signatures, norms, out=signatures, where=norms > 0)
+    return signatures
+
+
+def mmr_select(relevance, similarity, k, mmr_lambda=MMR_LAMBDA, duplicate_threshold=DUPLICATE_THRESHOLD):
+    """Greedy MMR over a precomputed similarity matrix; returns selected row indices in order."""
+    count = len(relevance)
+    available = np.ones(count, dtype=bool)
+    closest = np.zeros(count, dtype=np.float32)
+    selected = []
+    while len(selected) < k and available.any():
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * closest, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        closest = np.maximum(closest, similarity[best])
+        available &= similarity[best] < duplicate_threshold
+    return selected
+
+
+def diversify(docs, k, mmr_lambda=MMR_LAMBDA, duplicate_threshold=DUPLICATE_THRESHOLD):
+    """Pick k diverse documents from a relevance-ordered candidate list."""
+    if len(docs) <= 1:
+        return docs[:k]
+    relevance = np.array([doc.metadata.get("rrf", doc.metadata.get("score", 0.0)) for doc in docs], dtype=np.float32)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+
+    signatures = shingle_signatures([doc.page_content for doc in docs])
+    selected = mmr_select(relevance, signatures @ signatures.T, k, mmr_lambda, duplicate_threshold)
+    return [docs[i] for i in selected]
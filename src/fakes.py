@@ -0,0 +1,74 @@
+import re
+import time
+import random
+import threading
+
+
+class FakeIndexError(Exception):
+    pass
+
+
+class FakeIndex:
+    """In-memory stand-in for a Pinecone index with injectable latency and failures.
+
+    Implements the subset of the data-plane API the app uses: upsert_records, search
+    and delete. Scores are the fraction of query words found in a chunk, which is
+    enough to exercise retrieval without an embedding model.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.namespaces = {}
+        self.calls = {"upsert_records": 0, "search": 0, "delete": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _simulate(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise FakeIndexError(f"injected {operation} failure")
+
+    def upsert_records(self, namespace, records):
+        self._simulate("upsert_records")
+        with self._lock:
+            store = self.namespaces.setdefault(namespace, {})
+            for record in records:
+                store[record["_id"]] = dict(record)
+
+    def search(self, namespace, query, fields=None):
+        self._simulate("search")
+        words = set(re.findall(r"\w+", query["inputs"]["text"].lower()))
+        with self._lock:
+            records = list(self.namespaces.get(namespace, {}).values())
+        hits = []
+        for record in records:
+            found = words & set(re.findall(r"\w+", record["chunk_text"].lower()))
+            if found:
+                hits.append({
+                    "_id": record["_id"],
+                    "_score": len(found) / len(words),
+                    "fields": {k: v for k, v in record.items() if k != "_id" and (fields is None or k in fields)},
+                })
+        hits.sort(key=lambda hit: hit["_score"], reverse=True)
+        return {"result": {"hits": hits[:query.get("top_k", 10)]}}
+
+    def describe_index_stats(self):
+        with self._lock:
+            return {"namespaces": {name: {"vector_count": len(store)} for name, store in self.namespaces.items()}}
+
+    def delete(self, ids=None, namespace=None, delete_all=False):
+        self._simulate("delete")
+        with self._lock:
+            if delete_all:
+                self.namespaces.pop(namespace, None)
+                return
+            store = self.namespaces.get(namespace, {})
+            for record_id in ids or []:
+                store.pop(record_id, None)
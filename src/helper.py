@@ -1,13 +1,28 @@
 import os
 from dotenv import load_dotenv
-# from langchain.document_loaders import PyPDFLoader   old import
-from langchain_community.document_loaders import PyPDFLoader    #updated import
-#from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from pinecone import Pinecone
-from openai import OpenAI
-import tempfile
+from pinecone import NotFoundException
+from openai import OpenAI, AsyncOpenAI
+from pypdf import PdfReader
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from io import BytesIO
+from itertools import chain
+from src.upsert import upsert_batches, UpsertError
+from src.manifest import load_manifest, save_manifest
+from src.chunker import iter_token_chunks, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+from src.cache import LRUCache
+from src.vectorstore import get_vector_store
+from src.lexical import LexicalIndexBuilder, search_lexical, namespace_generation, bump_generation
+from src.diversity import diversify
+from src.context import pack_context, record_prompt
+from src.llm import stream_chat, astream_chat
+from src.singleflight import SingleFlight
+import asyncio
+import multiprocessing
+import hashlib
+import heapq
+import logging
 import re
 
 def is_strong_password(password):
@@ -25,86 +40,323 @@ def is_strong_password(password):
     return True
 
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
-pinecone_api_key = os.getenv("PINECONE_API_KEY")
-pc = Pinecone(api_key=pinecone_api_key)
 client = OpenAI()
+async_client = AsyncOpenAI()
+
+# Search results keyed on (username, namespace, generation, normalised query, k), dropped whenever the namespace changes.
+# The generation lives in LEXICAL_INDEX_DIR, so an upload or delete in one worker retires every worker's entries.
+retrieval_cache = LRUCache(
+    max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", 2048)),
+    max_bytes=int(os.getenv("RETRIEVAL_CACHE_BYTES", 32 * 1024 * 1024)),
+    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", 600)),
+)
+
+# Concurrent cache misses for the same key share one search
+retrieval_flights = SingleFlight()
+
+# Namespace value the chat UI sends to search all of a user's PDFs at once
+ALL_NAMESPACES = "__all__"
+# Per-namespace searches of an "all documents" question run on this pool
+_fanout_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SEARCH_FANOUT_WORKERS", 8)), thread_name_prefix="fanout")
+# Dense searches run on this pool while the local BM25 search runs in the request thread
+_dense_pool = ThreadPoolExecutor(max_workers=int(os.getenv("DENSE_SEARCH_WORKERS", 8)), thread_name_prefix="dense")
+# Reciprocal rank fusion constant; larger values flatten the advantage of top ranks
+RRF_K = 60
+# Candidates fetched per requested chunk before diversity selection
+RETRIEVAL_FETCH_FACTOR = int(os.getenv("RETRIEVAL_FETCH_FACTOR", 4))
+# BM25 score at which a lexical hit is used as context even if its dense score is below the threshold
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", 5.0))
+
+# Chunks buffered between the PDF parser and the vector store during ingestion.
+# This bounds peak memory per upload instead of the page count of the document.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 96))
+# Pinecone accepts up to 1000 IDs per delete call
+DELETE_BATCH_SIZE = 1000
+
+# Worker processes used to extract and chunk large PDFs; 1 keeps extraction in-process.
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", 1))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))
 
 def create_or_get_index(username):
-    if not pc.has_index(username):
-        pc.create_index_for_model(
-            name=username,
-            cloud="aws",
-            region="us-east-1",
-            embed={"model": "llama-text-embed-v2", "field_map": {"text": "chunk_text"}}
-        )
-    index = pc.Index(
-        host=f"https://{username}-uzat91r.svc.aped-4627-b74a.pinecone.io"
-    )
-    return index
+    return get_vector_store().get_index(username)
+
+def invalidate_index(username=None):
+    get_vector_store().invalidate(username)
+
+def _page_document(reader, page_number):
+    return Document(page_content=reader.pages[page_number].extract_text() or "", metadata={"page": page_number})
+
+def _report(progress, **fields):
+    if progress:
+        progress(**fields)
+
+def iter_pdf_pages(file_stream, progress=None):
+    # PdfReader parses straight from the in-memory buffer and resolves pages lazily
+    reader = PdfReader(file_stream)
+    _report(progress, pages_total=len(reader.pages))
+    for page_number in range(len(reader.pages)):
+        yield _page_document(reader, page_number)
+        _report(progress, pages_parsed=page_number + 1)
 
 def load_pdf_file_from_stream(file_stream):
+    return list(iter_pdf_pages(file_stream))
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(file_stream.read())
-        tmp_file.flush()
-        temp_path = tmp_file.name
+def chunk_data(docs, chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS):
+    return list(iter_chunks(docs, chunk_size, chunk_overlap))
 
-    loader = PyPDFLoader(temp_path)
-    docs = loader.load()
+def iter_chunks(pages, chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS):
+    # Sizes are in tokens; each page is chunked on its own as it arrives
+    return iter_token_chunks(pages, chunk_size, chunk_overlap)
 
-    os.remove(temp_path)
+_worker_reader = None
+_EXTRACT_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
 
-    return docs
+def _init_extract_worker(data):
+    global _worker_reader
+    _worker_reader = PdfReader(BytesIO(data))
+
+def _extract_page_range(start, stop, chunk_size, chunk_overlap):
+    pages = (_page_document(_worker_reader, page_number) for page_number in range(start, stop))
+    return list(iter_chunks(pages, chunk_size, chunk_overlap))
+
+def iter_chunks_parallel(file_stream, workers=PDF_EXTRACT_WORKERS, pages_per_task=PDF_PAGES_PER_TASK,
+                         chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS, progress=None):
+    data = file_stream.read()
+    num_pages = len(PdfReader(BytesIO(data)).pages)
+    _report(progress, pages_total=num_pages)
+
+    # The server process runs background threads (ingest pool, history writer, summaries), and a
+    # child forked while one of them holds a lock can deadlock, so workers come from a fork server
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_EXTRACT_CONTEXT, initializer=_init_extract_worker,
+                             initargs=(data,)) as pool:
+        # Keep a bounded window of page ranges in flight and yield them strictly in page order
+        pending = deque()
+        for start in range(0, num_pages, pages_per_task):
+            stop = min(start + pages_per_task, num_pages)
+            pending.append((stop, pool.submit(_extract_page_range, start, stop, chunk_size, chunk_overlap)))
+            if len(pending) >= workers * 2:
+                stop, future = pending.popleft()
+                yield from future.result()
+                _report(progress, pages_parsed=stop)
+        while pending:
+            stop, future = pending.popleft()
+            yield from future.result()
+            _report(progress, pages_parsed=stop)
+
+def iter_document_chunks(file_stream, workers=PDF_EXTRACT_WORKERS, progress=None):
+    if workers > 1:
+        return iter_chunks_parallel(file_stream, workers, progress=progress)
+    return iter_chunks(iter_pdf_pages(file_stream, progress))
 
-def chunk_data(docs, chunk_size=800, chunk_overlap=50):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    return splitter.split_documents(docs)
+def convert_chunks_to_list(chunks, seen=None):
+    # IDs depend on the chunk text rather than its position in the document, so edits elsewhere
+    # in a PDF leave them unchanged; the occurrence suffix tells repeated chunks (headers, footers) apart
+    seen = {} if seen is None else seen
+    records = []
+    for doc in chunks:
+        digest = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()[:24]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        record = {"_id": f"{digest}-{occurrence}", "chunk_text": doc.page_content}
+        if "token_count" in doc.metadata:
+            record["token_count"] = doc.metadata["token_count"]
+        records.append(record)
+    return records
 
-def convert_chunks_to_list(chunks):
-    return [{"_id": f"rec{i}", "chunk_text": doc.page_content} for i, doc in enumerate(chunks, 1)]
+def iter_record_batches(chunks, batch_size=INGEST_BATCH_SIZE):
+    batch = []
+    seen = {}
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield convert_chunks_to_list(batch, seen)
+            batch = []
+    if batch:
+        yield convert_chunks_to_list(batch, seen)
 
-def update_index_from_stream(username, namespace, file_stream):
-    docs = load_pdf_file_from_stream(file_stream)
+def _clear_namespace(index, namespace):
+    if namespace in index.describe_index_stats()["namespaces"]:
+        index.delete(namespace=namespace, delete_all=True)
 
-    chunks = chunk_data(docs)
-    text_list = convert_chunks_to_list(chunks)
+def update_index_from_stream(username, namespace, file_stream, batch_size=INGEST_BATCH_SIZE,
+                             workers=PDF_EXTRACT_WORKERS, progress=None):
+    """Index a PDF into the user's namespace.
 
-    if not text_list:
+    Only chunks missing from the namespace's manifest are upserted and chunks that are no
+    longer in the document are deleted, so re-uploading an unchanged PDF makes no writes.
+    progress, if given, is called with keyword updates (pages_total, pages_parsed,
+    chunks_upserted) as ingestion advances.
+    """
+    try:
+        return _update_index(username, namespace, file_stream, batch_size, workers, progress)
+    finally:
+        get_vector_store().commit(username, namespace)
+        invalidate_retrieval_cache(username, namespace)
+
+def _update_index(username, namespace, file_stream, batch_size, workers, progress):
+    chunks = iter_document_chunks(file_stream, workers, progress)
+
+    previous = load_manifest(username, namespace)
+    known = previous or set()
+    current = []
+    lexical = LexicalIndexBuilder()
+
+    def new_record_batches():
+        for records in iter_record_batches(chunks, batch_size):
+            current.extend(record["_id"] for record in records)
+            for record in records:
+                lexical.add(record)
+            new_records = [record for record in records if record["_id"] not in known]
+            if new_records:
+                yield new_records
+
+    batches = new_record_batches()
+    first = next(batches, None)
+    if not current:
         return f"No chunks found in uploaded file.", 0
 
-    index = create_or_get_index(username)
-    for i in range(0, len(text_list), 96):
-        index.upsert_records(namespace, text_list[i:i+96])
+    index = None
+    if first is not None or previous is None:
+        index = create_or_get_index(username)
+    if previous is None:
+        # Without a manifest the namespace contents are unknown, e.g. records indexed under the old rec{i} IDs
+        _clear_namespace(index, namespace)
 
-    return f"Index updated with {len(text_list)} chunks under namespace '{namespace}'.", len(text_list)
+    written = set()
+
+    def on_batch(records):
+        written.update(record["_id"] for record in records)
+        _report(progress, chunks_upserted=len(written))
+
+    if first is not None:
+        report = upsert_batches(index, namespace, chain([first], batches), on_batch=on_batch)
+        if report.failed_batches:
+            save_manifest(username, namespace, known | written)
+            raise UpsertError(report)
+
+    stale = list(known.difference(current))
+    if stale:
+        index = index or create_or_get_index(username)
+        for i in range(0, len(stale), DELETE_BATCH_SIZE):
+            index.delete(ids=stale[i:i+DELETE_BATCH_SIZE], namespace=namespace)
+
+    save_manifest(username, namespace, current)
+    lexical.save(username, namespace)
+
+    return (f"Index updated with {len(current)} chunks under namespace '{namespace}' "
+            f"({len(written)} new, {len(stale)} removed).", len(current))
+
+def normalize_query(query):
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+def invalidate_retrieval_cache(username, namespace):
+    # Called once the namespace's changes are committed, so a search that started before then
+    # stores its results under the old generation, which no later lookup uses
+    bump_generation(username, namespace)
+    retrieval_cache.invalidate(lambda key: key[0] == username and key[1] == namespace)
 
 def retrieve_query(query, username, namespace, k=4):
+    key = (username, namespace, namespace_generation(username, namespace), normalize_query(query), k)
+    docs = retrieval_cache.get(key)
+    if docs is None:
+        # Concurrent identical searches share one trip to the index
+        docs = retrieval_flights.do(key, lambda: _retrieve(query, username, namespace, k, key))
+    return list(docs)
+
+def _retrieve(query, username, namespace, k, key):
+    # Over-fetch, then keep a diverse top-k so near-identical chunks don't crowd the prompt
+    candidates = _hybrid_search(query, username, namespace, k * RETRIEVAL_FETCH_FACTOR)
+    docs = diversify(candidates, k)
+    retrieval_cache.set(key, docs, size=sum(len(doc.page_content) for doc in docs) + 256)
+    return docs
+
+def _hybrid_search(query, username, namespace, k):
+    dense = _dense_pool.submit(_search_index, query, username, namespace, k)
+    lexical = search_lexical(username, namespace, query, k)
+    return fuse_results(dense.result(), lexical, k)
+
+def fuse_results(dense_docs, lexical_hits, k):
+    # Reciprocal rank fusion: score each chunk by 1 / (RRF_K + rank) in every list it appears in
+    fused = {}
+    for rank, doc in enumerate(dense_docs):
+        fused[doc.metadata["id"]] = doc
+        doc.metadata["rrf"] = 1 / (RRF_K + rank + 1)
+    for rank, hit in enumerate(lexical_hits):
+        doc = fused.get(hit["_id"])
+        if doc is None:
+            doc = Document(page_content=hit["fields"]["chunk_text"],
+                           metadata={"id": hit["_id"], "score": 0.0, "rrf": 0.0,
+                                     "token_count": hit["fields"].get("token_count")})
+            fused[hit["_id"]] = doc
+        doc.metadata["bm25"] = hit["_score"]
+        doc.metadata["rrf"] += 1 / (RRF_K + rank + 1)
+    return sorted(fused.values(), key=lambda doc: doc.metadata["rrf"], reverse=True)[:k]
+
+def _search_index(query, username, namespace, k):
     index = create_or_get_index(username)
-    results = index.search(
-        namespace=namespace,
-        query={"inputs": {"text": query}, "top_k": k},
-        fields=["chunk_text"]
-    )
+    try:
+        results = index.search(
+            namespace=namespace,
+            query={"inputs": {"text": query}, "top_k": k},
+            fields=["chunk_text", "token_count"]
+        )
+    except NotFoundException:
+        # The cached handle points at an index that no longer exists
+        invalidate_index(username)
+        raise
     hits = results['result']['hits']
     docs = []
     for hit in hits:
         if 'fields' in hit:
             docs.append(Document(
                 page_content=hit['fields']['chunk_text'],
-                metadata={"score": hit.get('_score', 0.0)}
+                metadata={"id": hit['_id'], "score": hit.get('_score', 0.0),
+                          "token_count": hit['fields'].get('token_count')}
             ))
     return docs
 
-def answer_query_stream(query, username, namespace=None):
-    if namespace:
-        docs = retrieve_query(query, username, namespace)
-        threshold = 0.2
-        relevant_docs = [doc for doc in docs if doc.metadata.get("score", 0) >= threshold]
+def is_relevant(doc, threshold=0.2):
+    return doc.metadata.get("score", 0) >= threshold or doc.metadata.get("bm25", 0) >= LEXICAL_MIN_SCORE
+
+def retrieve_across_namespaces(query, username, namespaces, k=4):
+    """Search every namespace in parallel and merge the hits into one top-k.
+
+    Each returned Document carries the namespace it came from in metadata["namespace"].
+    A namespace whose search fails is skipped rather than failing the whole answer.
+    """
+    futures = [(namespace, _fanout_pool.submit(retrieve_query, query, username, namespace, k))
+               for namespace in namespaces]
+    docs = []
+    for namespace, future in futures:
+        try:
+            hits = future.result()
+        except Exception:
+            logger.exception("Search of namespace %r for %r failed", namespace, username)
+            continue
+        docs.extend(Document(page_content=doc.page_content, metadata={**doc.metadata, "namespace": namespace})
+                    for doc in hits)
+    # Fused ranks are comparable across namespaces; dense scores alone would sink lexical-only hits
+    return heapq.nlargest(k, docs, key=lambda doc: (is_relevant(doc), doc.metadata.get("rrf", 0),
+                                                    doc.metadata.get("score", 0)))
+
+def build_messages(query, username, namespace=None, namespaces=None, history=None, on_prompt=None):
+    """Messages for the chat completion; on_prompt, if given, is called with the prompt's token count."""
+    context_tokens = chunks_used = 0
+    if namespace or namespaces:
+        if namespaces:
+            docs = retrieve_across_namespaces(query, username, namespaces)
+        else:
+            docs = retrieve_query(query, username, namespace)
+        relevant_docs = [doc for doc in docs if is_relevant(doc)]
 
         if relevant_docs:
-            context = "\n\n".join(doc.page_content for doc in relevant_docs)
+            label = (lambda doc: f"[{doc.metadata['namespace']}] ") if namespaces else None
+            context, context_tokens, chunks_used = pack_context(relevant_docs, label=label)
             prompt = f"Answer the user using ONLY the context below if possible.\n\nContext:\n{context}\n\nQuestion:\n{query}"
         else:
             prompt = query
@@ -112,16 +364,21 @@ def answer_query_stream(query, username, namespace=None):
         # fallback to base LLM
         prompt = query
 
-    stream = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        stream=True
-    )
-
-    for chunk in stream:
-        content = chunk.choices[0].delta.content if chunk.choices[0].delta else None
-        if content:
-            yield content
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        *(history or []),
+        {"role": "user", "content": prompt}
+    ]
+    prompt_tokens = record_prompt(messages, context_tokens, chunks_used)
+    if on_prompt:
+        on_prompt(prompt_tokens)
+    return messages
+
+def answer_query_stream(query, username, namespace=None, namespaces=None, history=None, on_prompt=None):
+    yield from stream_chat(client, build_messages(query, username, namespace, namespaces, history, on_prompt))
+
+async def answer_query_astream(query, username, namespace=None, namespaces=None, history=None, on_prompt=None):
+    # Retrieval is blocking I/O against the vector store and local files, so it runs on a thread
+    messages = await asyncio.to_thread(build_messages, query, username, namespace, namespaces, history, on_prompt)
+    async for content in astream_chat(async_client, messages):
+        yield content
@@ -0,0 +1,218 @@
+import os
+import json
+import glob
+import atexit
+import logging
+import threading
+from datetime import datetime
+from src.models import db, User, ChatHistory
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Buffered turns are written in one bulk insert once this many are waiting ...
+HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", 50))
+# ... or once the oldest has waited this many seconds
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 1.0))
+# Buffered turns are also appended here so a crashed worker's turns are inserted by the next one to start
+HISTORY_SPILL_DIR = os.getenv("HISTORY_SPILL_DIR", "history_spill")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class HistoryWriter:
+    """Write-behind buffer for ChatHistory rows.
+
+    record() appends the turn to this process's spill file and returns without touching
+    the database. A background thread inserts the buffered rows in bulk. The spill file
+    is rotated when a flush starts and deleted once the insert commits, so a crash
+    loses nothing. Rows from a crash between the commit and the delete are inserted a
+    second time. Spill files left by dead processes are claimed and replayed on startup.
+    """
+
+    def __init__(self, app=None, flush_rows=HISTORY_FLUSH_ROWS, flush_interval=HISTORY_FLUSH_INTERVAL,
+                 spill_dir=HISTORY_SPILL_DIR):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.app = None
+        self.flushed = 0
+        self.flushes = 0
+        self._rows = []
+        self._spilled = []
+        self._spill = None
+        self._sequence = 0
+        self._pid = None
+        self._stopping = False
+        self._thread = None
+        self._wake = threading.Condition()
+        self._flush_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.close)
+
+    def _start(self):
+        # Runs in the process that records the first turn, so gunicorn's forked workers each get their own thread and spill file
+        self._pid = os.getpid()
+        self._stopping = False
+        self._rows = []
+        self._spilled = []
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._recover()
+        self._spill = open(self._spill_path(), "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f"pending-{self._pid}.jsonl")
+
+    def _recover(self):
+        for path in glob.glob(os.path.join(self.spill_dir, "*.jsonl")):
+            try:
+                pid = int(os.path.basename(path).split("-")[1].split(".")[0])
+            except (IndexError, ValueError):
+                continue
+            if pid != self._pid and _pid_alive(pid):
+                continue
+            claimed = os.path.join(self.spill_dir, f"recovered-{self._pid}-{self._next_sequence()}.jsonl")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            logger.info("Replaying %d chat turns from %s", len(rows), path)
+            self._rows.extend(rows)
+            self._spilled.append(claimed)
+
+    def _next_sequence(self):
+        self._sequence += 1
+        return self._sequence
+
+    def record(self, username, user_message, bot_response, user_id=None):
+        row = {
+            "username": username,
+            "user_id": user_id,
+            "user_message": user_message,
+            "bot_response": bot_response,
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+        with self._wake:
+            if self._pid != os.getpid():
+                self._start()
+            self._spill.write(json.dumps(row) + "\n")
+            self._spill.flush()
+            self._rows.append(row)
+            if len(self._rows) >= self.flush_rows:
+                self._wake.notify()
+
+    def pending(self, username=None):
+        with self._wake:
+            if self._pid != os.getpid():
+                return 0
+            return sum(1 for row in self._rows if username is None or row["username"] == username)
+
+    def _run(self):
+        while True:
+            with self._wake:
+                if not self._stopping and len(self._rows) < self.flush_rows:
+                    self._wake.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Chat history flush failed; will retry")
+
+    def flush(self):
+        """Insert every buffered row now. Rows stay buffered and spilled if the insert fails."""
+        with self._flush_lock:
+            with self._wake:
+                if self._pid != os.getpid() or not self._rows:
+                    return 0
+                rows, self._rows = self._rows, []
+                # New turns go to a fresh spill file while this batch is inserted
+                self._spill.close()
+                rotated = os.path.join(self.spill_dir, f"flushing-{self._pid}-{self._next_sequence()}.jsonl")
+                os.replace(self._spill_path(), rotated)
+                self._spilled.append(rotated)
+                self._spill = open(self._spill_path(), "a", encoding="utf-8")
+                spilled = list(self._spilled)
+
+            try:
+                with self.app.app_context():
+                    self._insert(rows)
+            except Exception:
+                with self._wake:
+                    self._rows[:0] = rows
+                raise
+
+            with self._wake:
+                self._spilled = [path for path in self._spilled if path not in spilled]
+                self.flushed += len(rows)
+                self.flushes += 1
+            for path in spilled:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return len(rows)
+
+    def _insert(self, rows):
+        # Rows carry the id from the session; only rows without one need a lookup
+        usernames = {row["username"] for row in rows if row.get("user_id") is None}
+        user_ids = {}
+        if usernames:
+            user_ids = dict(db.session.query(User.username, User.id).filter(User.username.in_(usernames)).all())
+        mappings = []
+        for row in rows:
+            user_id = row.get("user_id") or user_ids.get(row["username"])
+            if user_id is None:
+                logger.warning("Dropping chat turn for unknown user %s", row["username"])
+                continue
+            mappings.append({
+                "user_id": user_id,
+                "user_message": row["user_message"],
+                "bot_response": row["bot_response"],
+                "timestamp": datetime.fromisoformat(row["timestamp"]),
+            })
+        if mappings:
+            db.session.execute(db.insert(ChatHistory), mappings)
+        db.session.commit()
+
+    def close(self):
+        with self._wake:
+            if self._pid != os.getpid():
+                return
+            self._stopping = True
+            self._wake.notify()
+        self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Chat history flush on shutdown failed; rows remain in %s", self.spill_dir)
+        with self._wake:
+            self._spill.close()
+            if os.path.exists(self._spill_path()) and not os.path.getsize(self._spill_path()):
+                os.remove(self._spill_path())
+            self._pid = None
+
+    def stats(self):
+        return {"pending": self.pending(), "flushed": self.flushed, "flushes": self.flushes}
+
+
+history_writer = HistoryWriter()
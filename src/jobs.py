@@ -0,0 +1,138 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from io import BytesIO
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from src.models import db, IngestJob, UserPDF
+from src.helper import update_index_from_stream
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+# Uploads waiting for a worker keep their file in memory, so the backlog per process is capped
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", 16))
+# Minimum seconds between progress writes to the IngestJob row
+PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", 1.0))
+# Jobs run in the executor of the process that accepted the upload, so a restart loses them.
+# A job still queued or indexing this long after upload is reported as failed.
+INGEST_JOB_TIMEOUT = float(os.getenv("INGEST_JOB_TIMEOUT", 3600))
+
+executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+def enqueue_ingest_job(app, user_id, username, namespace, filename, data):
+    global _pending
+    with _pending_lock:
+        if _pending >= INGEST_MAX_PENDING:
+            raise IngestQueueFull("Too many uploads are being processed, please try again shortly.")
+        _pending += 1
+
+    try:
+        job = IngestJob(id=uuid.uuid4().hex, user_id=user_id, pdf_name=namespace, filename=filename)
+        db.session.add(job)
+        db.session.commit()
+        executor.submit(_run_job, app, job.id, username, data)
+    except Exception:
+        _release()
+        raise
+    return job
+
+
+def _release():
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+def _run_job(app, job_id, username, data):
+    try:
+        with app.app_context():
+            _process(job_id, username, data)
+    except Exception:
+        logger.exception("Ingestion job %s crashed", job_id)
+    finally:
+        _release()
+
+
+def _process(job_id, username, data):
+    job = db.session.get(IngestJob, job_id)
+    job.stage = 'indexing'
+    job.started_at = datetime.utcnow()
+    db.session.commit()
+
+    last_flush = time.monotonic()
+
+    def progress(**fields):
+        nonlocal last_flush
+        for name, value in fields.items():
+            setattr(job, name, value)
+        if time.monotonic() - last_flush >= PROGRESS_INTERVAL:
+            db.session.commit()
+            last_flush = time.monotonic()
+
+    try:
+        update_message, chunks_indexed = update_index_from_stream(username, job.pdf_name, BytesIO(data),
+                                                                  progress=progress)
+        if not chunks_indexed:
+            job.stage = 'failed'
+            job.message = f'File {job.filename} uploaded but contains no valid text — nothing was indexed.'
+        else:
+            # Save to the database only once every chunk is indexed
+            existing = UserPDF.query.filter_by(user_id=job.user_id, pdf_name=job.pdf_name).first()
+            if not existing:
+                db.session.add(UserPDF(user_id=job.user_id, pdf_name=job.pdf_name))
+            job.stage = 'done'
+            job.message = f'File {job.filename} uploaded and indexed!'
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(IngestJob, job_id)
+        job.stage = 'failed'
+        job.message = f"Error processing file: {str(e)}"
+
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _expire_if_stale(job):
+    if job.stage in ('done', 'failed') or not job.created_at:
+        return
+    if (datetime.utcnow() - job.created_at).total_seconds() < INGEST_JOB_TIMEOUT:
+        return
+    job.stage = 'failed'
+    job.message = f'Indexing {job.filename} was interrupted, please upload it again.'
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def job_status(job):
+    _expire_if_stale(job)
+    eta = None
+    if job.stage == 'indexing' and job.started_at and job.pages_parsed:
+        elapsed = (datetime.utcnow() - job.started_at).total_seconds()
+        remaining = max(job.pages_total - job.pages_parsed, 0)
+        eta = round(elapsed / job.pages_parsed * remaining, 1)
+    elif job.stage in ('done', 'failed'):
+        eta = 0
+
+    return {
+        'job_id': job.id,
+        'namespace': job.pdf_name,
+        'stage': job.stage,
+        'pages_total': job.pages_total,
+        'pages_parsed': job.pages_parsed,
+        'chunks_upserted': job.chunks_upserted,
+        'eta_seconds': eta,
+        'message': job.message,
+    }
@@ -0,0 +1,243 @@
+import os
+import re
+import json
+import math
+import time
+import tempfile
+from array import array
+from collections import Counter
+from urllib.parse import quote
+import numpy as np
+from dotenv import load_dotenv
+from src.cache import LRUCache
+from src.segments import pack_strings
+
+load_dotenv()
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "lexical_index")
+# Postings held in memory while indexing before they are sorted and spilled to disk
+LEXICAL_SPILL_POSTINGS = int(os.getenv("LEXICAL_SPILL_POSTINGS", 1000000))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Part numbers, error codes and clause IDs ("E-102", "4.2.1") are kept whole and also indexed by their parts
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+_SEPARATOR = re.compile(r"[-_./:]")
+
+_loaded = LRUCache(max_entries=int(os.getenv("LEXICAL_CACHE_SIZE", 256)))
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = _SEPARATOR.split(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def index_path(username, namespace):
+    return os.path.join(LEXICAL_INDEX_DIR, quote(username, safe=""), f"{quote(namespace, safe='')}.npz")
+
+
+def generation_path(username, namespace):
+    return os.path.join(LEXICAL_INDEX_DIR, quote(username, safe=""), f"{quote(namespace, safe='')}.gen")
+
+
+def namespace_generation(username, namespace):
+    """Changes each time bump_generation() runs for the namespace, in any process sharing LEXICAL_INDEX_DIR."""
+    try:
+        return os.stat(generation_path(username, namespace)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump_generation(username, namespace):
+    # The file's mtime is the generation. It is kept when the namespace is deleted, so a delete
+    # changes it too, and it always moves forward even if the clock hasn't ticked since the last bump.
+    path = generation_path(username, namespace)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a"):
+        pass
+    previous = os.stat(path).st_mtime_ns
+    now = time.time_ns()
+    os.utime(path, ns=(now, max(now, previous + 1)))
+
+
+class LexicalIndexBuilder:
+    """Accumulates BM25 postings for one namespace as chunks stream past during ingestion.
+
+    Only the vocabulary and per-chunk lengths and offsets stay in memory. Postings are
+    sorted by term and spilled to a temporary file in runs of spill_postings, ids and
+    fields are appended to temporary files as chunks arrive, and save() merges the runs
+    into the index file through memory maps.
+    """
+
+    def __init__(self, spill_postings=LEXICAL_SPILL_POSTINGS):
+        self.spill_postings = spill_postings
+        self.vocabulary = {}
+        self.lengths = array("I")
+        self.runs = []
+        self.offsets = {"ids": array("q", [0]), "fields": array("q", [0])}
+        self.term_ids, self.doc_ids, self.tfs = array("I"), array("I"), array("H")
+        # Unlinked files next to the indexes, so spills go to the same disk rather than a RAM-backed /tmp
+        os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+        self.files = {name: tempfile.TemporaryFile(dir=LEXICAL_INDEX_DIR)
+                      for name in ("term_ids", "doc_ids", "tfs", "ids", "fields")}
+
+    def add(self, record):
+        doc = len(self.lengths)
+        terms = Counter(tokenize(record["chunk_text"]))
+        for term, tf in terms.items():
+            self.term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+            self.doc_ids.append(doc)
+            self.tfs.append(min(tf, 65535))
+        self.lengths.append(sum(terms.values()))
+        self._append("ids", record["_id"])
+        self._append("fields", json.dumps({k: v for k, v in record.items() if k != "_id"}))
+        if len(self.term_ids) >= self.spill_postings:
+            self._spill()
+
+    def _append(self, name, text):
+        data = text.encode("utf-8")
+        self.files[name].write(data)
+        self.offsets[name].append(self.offsets[name][-1] + len(data))
+
+    def _spill(self):
+        if not self.term_ids:
+            return
+        term_ids = np.frombuffer(self.term_ids, dtype=np.uint32)
+        # Stable, so each term's documents stay in the order they were added
+        order = np.argsort(term_ids, kind="stable")
+        self.files["term_ids"].write(term_ids[order].tobytes())
+        self.files["doc_ids"].write(np.frombuffer(self.doc_ids, dtype=np.uint32)[order].tobytes())
+        self.files["tfs"].write(np.frombuffer(self.tfs, dtype=np.uint16)[order].tobytes())
+        self.runs.append(len(order))
+        self.term_ids, self.doc_ids, self.tfs = array("I"), array("I"), array("H")
+
+    @staticmethod
+    def _mapped(f, dtype, mode="r", shape=None):
+        f.flush()
+        if shape == 0 or (shape is None and not os.fstat(f.fileno()).st_size):
+            return np.empty(0, dtype=dtype)
+        return np.memmap(f, dtype=dtype, mode=mode, shape=shape)
+
+    def save(self, username, namespace):
+        try:
+            self._save(username, namespace)
+        finally:
+            for f in self.files.values():
+                f.close()
+
+    def _save(self, username, namespace):
+        self._spill()
+        terms = sorted(self.vocabulary)
+        rank = np.empty(len(terms), dtype=np.int64)
+        term_numbers = np.fromiter((self.vocabulary[term] for term in terms), dtype=np.int64, count=len(terms))
+        rank[term_numbers] = np.arange(len(terms))
+        self.vocabulary.clear()
+
+        term_ids = self._mapped(self.files["term_ids"], np.uint32)
+        doc_ids = self._mapped(self.files["doc_ids"], np.uint32)
+        tfs = self._mapped(self.files["tfs"], np.uint16)
+        bounds = np.cumsum([0] + self.runs)
+        counts = np.zeros(len(terms), dtype=np.int64)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            counts += np.bincount(term_ids[start:stop], minlength=len(terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts[np.argsort(rank)], out=offsets[1:])
+
+        # Each run is sorted by term, so it scatters into its terms' slices after the earlier runs' postings
+        for name in ("merged_doc_ids", "merged_tfs"):
+            self.files[name] = tempfile.TemporaryFile(dir=LEXICAL_INDEX_DIR)
+        merged_doc_ids = self._mapped(self.files["merged_doc_ids"], np.uint32, "w+", offsets[-1])
+        merged_tfs = self._mapped(self.files["merged_tfs"], np.uint16, "w+", offsets[-1])
+        cursor = offsets[:-1][rank]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            run_terms = term_ids[start:stop].astype(np.int64)
+            within = np.arange(len(run_terms)) - np.searchsorted(run_terms, run_terms)
+            destination = cursor[run_terms] + within
+            merged_doc_ids[destination] = doc_ids[start:stop]
+            merged_tfs[destination] = tfs[start:stop]
+            cursor += np.bincount(run_terms, minlength=len(terms))
+
+        term_data, term_offsets = pack_strings(terms)
+        path = index_path(username, namespace)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer(term_data, dtype=np.uint8), term_offsets=term_offsets,
+                postings=offsets, doc_ids=merged_doc_ids, tfs=merged_tfs,
+                lengths=np.array(self.lengths, dtype=np.uint32),
+                ids=self._mapped(self.files["ids"], np.uint8), id_offsets=np.array(self.offsets["ids"], dtype=np.int64),
+                fields=self._mapped(self.files["fields"], np.uint8),
+                field_offsets=np.array(self.offsets["fields"], dtype=np.int64),
+            )
+        os.replace(f"{path}.tmp", path)
+
+
+def _unpack(data, offsets):
+    raw = data.tobytes()
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+class LexicalIndex:
+    def __init__(self, path):
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        self.terms = {term: i for i, term in enumerate(_unpack(arrays["terms"], arrays["term_offsets"]))}
+        self.postings = arrays["postings"]
+        self.doc_ids = arrays["doc_ids"]
+        self.tfs = arrays["tfs"].astype(np.float32)
+        self.ids = _unpack(arrays["ids"], arrays["id_offsets"])
+        self.fields = _unpack(arrays["fields"], arrays["field_offsets"])
+        lengths = arrays["lengths"].astype(np.float32)
+        average = lengths.mean() if len(lengths) else 1.0
+        # Per-document part of the BM25 denominator, precomputed once per load
+        self.norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (average or 1.0))
+
+    def search(self, query, k):
+        count = len(self.ids)
+        scores = np.zeros(count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.terms.get(term)
+            if i is None:
+                continue
+            start, stop = self.postings[i], self.postings[i + 1]
+            docs = self.doc_ids[start:stop]
+            tfs = self.tfs[start:stop]
+            idf = math.log(1 + (count - (stop - start) + 0.5) / ((stop - start) + 0.5))
+            scores[docs] += idf * tfs * (BM25_K1 + 1) / (tfs + self.norms[docs])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [{"_id": self.ids[doc], "_score": float(scores[doc]), "fields": json.loads(self.fields[doc])}
+                for doc in matched]
+
+
+def search_lexical(username, namespace, query, k):
+    """BM25 hits for query in the namespace, or an empty list if it has no lexical index."""
+    path = index_path(username, namespace)
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    index = _loaded.get((path, modified))
+    if index is None:
+        index = LexicalIndex(path)
+        _loaded.invalidate(lambda key: key[0] == path)
+        _loaded.set((path, modified), index)
+    return index.search(query, k)
+
+
+def delete_lexical_index(username, namespace):
+    path = index_path(username, namespace)
+    _loaded.invalidate(lambda key: key[0] == path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,219 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+from src.cache import LRUCache
+from src.singleflight import StreamFlights
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-3.5-turbo")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 1024))
+LLM_CACHE_BYTES = int(os.getenv("LLM_CACHE_BYTES", 16 * 1024 * 1024))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 86400))
+# Optional second tier shared by every worker on the host; empty keeps the cache in memory only
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+LLM_CACHE_DIR_BYTES = int(os.getenv("LLM_CACHE_DIR_BYTES", 256 * 1024 * 1024))
+# The disk tier is checked against LLM_CACHE_DIR_BYTES after this many writes
+PRUNE_EVERY = 64
+
+
+def cache_key(model, messages):
+    payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Completed answers, stored as the list of streamed chunks, keyed by cache_key.
+
+    Lookups go to the in-process LRU first and then to the disk tier, promoting disk
+    hits into memory. Disk entries are one JSON file each, written atomically, expired
+    by mtime and pruned oldest first, on a background thread, once the directory
+    outgrows max_disk_bytes. aget and aset do the disk I/O on a thread so it never
+    blocks an event loop.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_SIZE, max_bytes=LLM_CACHE_BYTES, ttl=LLM_CACHE_TTL,
+                 directory=LLM_CACHE_DIR, max_disk_bytes=LLM_CACHE_DIR_BYTES):
+        self.memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_hits = 0
+        self._writes = 0
+        self._pruning = False
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        chunks = self.memory.get(key)
+        if chunks is not None or not self.directory:
+            return chunks
+        return self._disk_get(key)
+
+    async def aget(self, key):
+        chunks = self.memory.get(key)
+        if chunks is not None or not self.directory:
+            return chunks
+        return await asyncio.to_thread(self._disk_get, key)
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                chunks = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self.memory.set(key, chunks, size=_size(chunks))
+        return chunks
+
+    def set(self, key, chunks):
+        self.memory.set(key, chunks, size=_size(chunks))
+        if self.directory:
+            self._disk_set(key, chunks)
+
+    async def aset(self, key, chunks):
+        self.memory.set(key, chunks, size=_size(chunks))
+        if self.directory:
+            await asyncio.to_thread(self._disk_set, key, chunks)
+
+    def _disk_set(self, key, chunks):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(chunks, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Could not write answer cache entry %s", key)
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0 and not self._pruning
+            if prune:
+                self._pruning = True
+        if prune:
+            # Walking the whole directory takes a while, so the writer doesn't wait for it
+            threading.Thread(target=self._background_prune, name="answer-cache-prune", daemon=True).start()
+
+    def _background_prune(self):
+        try:
+            self.prune()
+        except Exception:
+            logger.exception("Could not prune the answer cache")
+        finally:
+            with self._lock:
+                self._pruning = False
+
+    def prune(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        return {**self.memory.stats(), "disk_hits": self.disk_hits, "disk": bool(self.directory)}
+
+
+def _size(chunks):
+    return sum(len(chunk) for chunk in chunks) + 64 * len(chunks)
+
+
+answer_cache = AnswerCache()
+stream_flights = StreamFlights()
+
+
+def stream_chat(client, messages, model=CHAT_MODEL, cache=answer_cache):
+    """Yield the answer to messages as text chunks, replaying a cached answer when there is one.
+
+    A replay yields the same chunks the original stream produced. Only streams that
+    run to a finish_reason are cached, so an answer cut short by an error or a client
+    disconnect is never replayed. A request identical to one still streaming joins it,
+    getting the chunks produced so far and then the rest as they arrive.
+    """
+    key = cache_key(model, messages)
+    chunks = cache.get(key)
+    if chunks is not None:
+        yield from chunks
+        return
+    # Identical requests that are already streaming share that stream instead of starting another
+    yield from stream_flights.subscribe(key, lambda: _stream(client, messages, model, cache, key))
+
+
+def _stream(client, messages, model, cache, key):
+    chunks = []
+    finished = False
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True)
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        content = choice.delta.content if choice.delta else None
+        if content:
+            chunks.append(content)
+            yield content
+        if choice.finish_reason:
+            finished = True
+    if finished:
+        cache.set(key, chunks)
+
+
+async def astream_chat(client, messages, model=CHAT_MODEL, cache=answer_cache):
+    """stream_chat for an AsyncOpenAI client, sharing the same answer cache."""
+    key = cache_key(model, messages)
+    chunks = await cache.aget(key)
+    if chunks is not None:
+        for content in chunks:
+            yield content
+        return
+    async for content in stream_flights.asubscribe(key, lambda: _astream(client, messages, model, cache, key)):
+        yield content
+
+
+async def _astream(client, messages, model, cache, key):
+    chunks = []
+    finished = False
+    stream = await client.chat.completions.create(model=model, messages=messages, stream=True)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        content = choice.delta.content if choice.delta else None
+        if content:
+            chunks.append(content)
+            yield content
+        if choice.finish_reason:
+            finished = True
+    if finished:
+        await cache.aset(key, chunks)
@@ -0,0 +1,25 @@
+from src.models import db, ChunkManifest
+
+# The manifest records the chunk IDs currently stored in each (user, namespace), so
+# re-indexing can upsert only new chunks and delete the ones that disappeared.
+
+
+def load_manifest(username, namespace):
+    manifest = ChunkManifest.query.filter_by(username=username, namespace=namespace).first()
+    if manifest is None:
+        return None
+    return set(manifest.chunk_ids.split("\n")) if manifest.chunk_ids else set()
+
+
+def save_manifest(username, namespace, chunk_ids):
+    manifest = ChunkManifest.query.filter_by(username=username, namespace=namespace).first()
+    if manifest is None:
+        manifest = ChunkManifest(username=username, namespace=namespace)
+        db.session.add(manifest)
+    manifest.chunk_ids = "\n".join(sorted(chunk_ids))
+    db.session.commit()
+
+
+def delete_manifest(username, namespace):
+    ChunkManifest.query.filter_by(username=username, namespace=namespace).delete()
+    db.session.commit()
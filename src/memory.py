@@ -0,0 +1,240 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from src.cache import LRUCache
+from src.context import count_tokens, PromptStats, MIN_TRIM_TOKENS
+from src.chunker import get_encoding
+from src.llm import CHAT_MODEL
+from src.models import db, User, ChatHistory
+from src.helper import client
+from src.history import history_writer
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Most recent turns replayed word for word; older turns are folded into the summary
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", 4))
+# Tokens of conversation memory (summary plus recent turns) allowed in a prompt
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", 800))
+# Upper bound on the length of the rolling summary
+SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", 200))
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", 4096))
+# Newest ChatHistory turns read on every history() call, to pick up turns other workers served
+MEMORY_RELOAD_TURNS = MEMORY_TURNS * 3
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the new turns into the summary. Keep names, numbers, document sections and open "
+    "questions the user may refer back to. Reply with the updated summary only, in under "
+    f"{SUMMARY_TOKENS * 3 // 4} words."
+)
+
+
+class _Conversation:
+    def __init__(self):
+        self.summary = ""
+        self.summary_tokens = 0
+        # (user_message, bot_response, tokens) not yet folded into the summary, oldest first
+        # Bounded so a failing summariser cannot let it grow without limit
+        self.turns = deque(maxlen=MEMORY_RELOAD_TURNS * 2)
+        # ChatHistory ids in the last window read, so only rows this process hasn't seen are merged
+        self.seen = set()
+        # (user_message, bot_response) added here whose rows the history writer hasn't flushed yet
+        self.unconfirmed = deque(maxlen=MEMORY_RELOAD_TURNS)
+        self.summarizing = False
+
+
+def _turn(user_message, bot_response):
+    return user_message, bot_response, count_tokens(user_message) + count_tokens(bot_response) + 8
+
+
+class ConversationMemory:
+    """Per-user conversation memory: a rolling summary plus the last few turns verbatim.
+
+    The summary is updated incrementally on a background thread. Each update folds in
+    only the turns that have aged out of the verbatim window. history() therefore never
+    calls the model, and its output stays under budget tokens however long the
+    conversation runs. State lives in a per-process LRU. Every history() call reads
+    the user's newest ChatHistory rows in one query. A process with no entry for the
+    user builds one from them. Otherwise rows it has not seen are merged in, except
+    for turns this process added itself. Turns served by other workers therefore
+    show up once their history writer flushes them.
+    """
+
+    def __init__(self, client=None, turns=MEMORY_TURNS, budget=MEMORY_TOKEN_BUDGET, cache_size=MEMORY_CACHE_SIZE):
+        self.client = client
+        self.turns = turns
+        self.budget = budget
+        self.summaries = 0
+        self.history_stats = PromptStats()
+        self._conversations = LRUCache(max_entries=cache_size)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=int(os.getenv("MEMORY_SUMMARY_WORKERS", 2)),
+                                        thread_name_prefix="summary")
+
+    def window(self, username, user_id=None):
+        """Statement for the user's newest MEMORY_RELOAD_TURNS ChatHistory rows, for history_from().
+
+        Run it right away: a process with no memory of the user first flushes the turns
+        it has buffered for them, so the window includes them.
+        """
+        self._flush_if_new(username)
+        statement = db.select(ChatHistory.id, ChatHistory.user_message, ChatHistory.bot_response,
+                              ChatHistory.timestamp)
+        if user_id is not None:
+            statement = statement.where(ChatHistory.user_id == user_id)
+        else:
+            statement = statement.join(User).where(User.username == username)
+        return (statement.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())
+                .limit(MEMORY_RELOAD_TURNS))
+
+    def _flush_if_new(self, username):
+        # A process building a user's memory from scratch must see the turns it has itself recorded
+        with self._lock:
+            cached = self._conversations.get(username) is not None
+        if not cached and history_writer.pending(username):
+            history_writer.flush()
+
+    def _sync(self, username, rows):
+        """Bring username's conversation up to date with rows, its newest ChatHistory rows."""
+        rows = sorted(rows, key=lambda row: (row.timestamp, row.id), reverse=True)
+        with self._lock:
+            conversation = self._conversations.get(username)
+            if conversation is not None:
+                elsewhere = self._unseen(conversation, rows)
+        if conversation is not None:
+            if elsewhere:
+                turns = [_turn(row.user_message, row.bot_response) for row in elsewhere]
+                with self._lock:
+                    conversation.turns.extend(turns)
+                self._maybe_summarize(username, conversation)
+            return conversation
+
+        conversation = _Conversation()
+        conversation.turns.extend(_turn(row.user_message, row.bot_response) for row in reversed(rows))
+        conversation.seen = {row.id for row in rows}
+        with self._lock:
+            existing = self._conversations.get(username)
+            if existing is not None:
+                return existing
+            self._conversations.set(username, conversation)
+        self._maybe_summarize(username, conversation)
+        return conversation
+
+    @staticmethod
+    def _unseen(conversation, rows):
+        """Rows, oldest first, that neither this process nor an earlier window has seen; call with the lock held."""
+        new = [row for row in reversed(rows) if row.id not in conversation.seen]
+        conversation.seen = {row.id for row in rows}
+        elsewhere = []
+        for row in new:
+            if conversation.unconfirmed and conversation.unconfirmed[0] == (row.user_message, row.bot_response):
+                # A turn add_turn() already appended, now flushed by this process's history writer
+                conversation.unconfirmed.popleft()
+            else:
+                elsewhere.append(row)
+        return elsewhere
+
+    def add_turn(self, username, user_message, bot_response):
+        with self._lock:
+            conversation = self._conversations.get(username)
+        if conversation is None:
+            # Built from ChatHistory, which will include this turn, the next time it is needed
+            return
+        turn = _turn(user_message, bot_response)
+        with self._lock:
+            conversation.turns.append(turn)
+            conversation.unconfirmed.append((user_message, bot_response))
+        self._maybe_summarize(username, conversation)
+
+    def _maybe_summarize(self, username, conversation):
+        with self._lock:
+            if conversation.summarizing or len(conversation.turns) <= self.turns or self.client is None:
+                return
+            conversation.summarizing = True
+        self._pool.submit(self._summarize, username, conversation)
+
+    def _summarize(self, username, conversation):
+        try:
+            while True:
+                with self._lock:
+                    folded = list(conversation.turns)[:len(conversation.turns) - self.turns]
+                    summary = conversation.summary
+                if not folded:
+                    return
+                transcript = "\n\n".join(f"User: {q}\nAssistant: {a}" for q, a, _ in folded)
+                response = self.client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=[
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user", "content": f"Summary so far:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"},
+                    ],
+                    max_tokens=SUMMARY_TOKENS,
+                )
+                summary = (response.choices[0].message.content or "").strip()
+                tokens = count_tokens(summary)
+                with self._lock:
+                    conversation.summary = summary
+                    conversation.summary_tokens = tokens
+                    for turn in folded:
+                        if conversation.turns and conversation.turns[0] is turn:
+                            conversation.turns.popleft()
+                    self.summaries += 1
+        except Exception:
+            logger.exception("Summarising the conversation of %s failed", username)
+        finally:
+            with self._lock:
+                conversation.summarizing = False
+
+    def history(self, username, user_id=None):
+        """Chat messages that carry the conversation so far, newest turns kept first, within budget tokens."""
+        if self.budget <= 0:
+            return []
+        # Needs an app context; callers load memory before handing the request to a stream
+        return self.history_from(username, db.session.execute(self.window(username, user_id)).all())
+
+    def history_from(self, username, rows):
+        """history() from the rows of window(), for callers that read them alongside something else."""
+        if self.budget <= 0:
+            return []
+        conversation = self._sync(username, rows)
+        with self._lock:
+            summary = conversation.summary
+            summary_tokens = conversation.summary_tokens
+            turns = list(conversation.turns)
+
+        messages = []
+        used = summary_tokens + 8 if summary else 0
+        remaining = self.budget - used
+        encoding = get_encoding()
+        for user_message, bot_response, tokens in reversed(turns):
+            if tokens > remaining:
+                # Keep the question and as much of the answer as fits, if that is worth sending
+                question_tokens = count_tokens(user_message) + 8
+                answer_room = remaining - question_tokens
+                if answer_room < MIN_TRIM_TOKENS:
+                    break
+                bot_response = encoding.decode(encoding.encode_ordinary(bot_response)[:answer_room])
+                tokens = question_tokens + answer_room
+            messages[:0] = [{"role": "user", "content": user_message}, {"role": "assistant", "content": bot_response}]
+            remaining -= tokens
+            used += tokens
+        if summary:
+            messages.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        self.history_stats.record(used)
+        return messages
+
+    def forget(self, username):
+        with self._lock:
+            self._conversations.invalidate(lambda key: key == username)
+
+    def stats(self):
+        return {"summaries": self.summaries, "history_tokens": self.history_stats.stats(),
+                "users": self._conversations.stats()["entries"], "budget": self.budget}
+
+
+conversation_memory = ConversationMemory(client)
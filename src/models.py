@@ -1,7 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from src.database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -17,10 +18,58 @@ class ChatHistory(db.Model):
 
     user = db.relationship('User', backref=db.backref('chat_history', lazy=True))
 
+    # History pages are read newest first per user with a (timestamp, id) cursor
+    __table_args__ = (db.Index('ix_chat_history_user_time', 'user_id', 'timestamp', 'id'),)
+
+class ChatHistoryArchive(db.Model):
+    """Cold tier of ChatHistory: one user's turns from one day, as a zlib-compressed JSON list.
+
+    Each row keeps its original id, so (timestamp, id) cursors stay valid across tiers.
+    A day may have several blobs if turns for it are archived in more than one run.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    rows = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_chat_archive_user_last', 'user_id', 'last_timestamp', 'last_id'),)
+
 class UserPDF(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     pdf_name = db.Column(db.String(255), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    user = db.relationship('User', backref=db.backref('pdfs', lazy=True))
\ No newline at end of file
+    user = db.relationship('User', backref=db.backref('pdfs', lazy=True))
+
+class IngestJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    pdf_name = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    stage = db.Column(db.String(20), nullable=False, default='queued')
+    pages_total = db.Column(db.Integer, nullable=False, default=0)
+    pages_parsed = db.Column(db.Integer, nullable=False, default=0)
+    chunks_upserted = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    user = db.relationship('User', backref=db.backref('ingest_jobs', lazy=True))
+
+
+class ChunkManifest(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(150), nullable=False)
+    namespace = db.Column(db.String(255), nullable=False)
+    chunk_ids = db.Column(db.Text, nullable=False, default='')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('username', 'namespace'),)
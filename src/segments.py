@@ -0,0 +1,141 @@
+import os
+import json
+import math
+import shutil
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Namespaces below this size are searched exhaustively; the IVF index only pays off on larger ones
+IVF_MIN_ROWS = int(os.getenv("LOCAL_IVF_MIN_ROWS", 4096))
+# Inverted lists scanned per query; 0 picks about 5% of the lists
+IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", 0))
+KMEANS_ITERATIONS = 8
+BLOCK_ROWS = 65536
+
+
+def pack_strings(strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return b"".join(encoded), offsets
+
+
+def _assign(vectors, centroids):
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + BLOCK_ROWS])
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_ivf(vectors, nlist, seed=0):
+    """Spherical k-means on a sample of the (normalised) vectors."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * 64)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+    return centroids.astype(np.float32)
+
+
+def write_segment(path, ids, fields, vectors):
+    """Write an immutable segment directory at path.
+
+    Rows are stored grouped by IVF list, so every list is one contiguous slice of
+    vectors.npy and a query only touches the pages of the lists it probes. ids and
+    per-row JSON fields are packed into flat byte files with int64 offsets so that
+    all of it can be memory-mapped.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    nlist = 1 if len(vectors) < IVF_MIN_ROWS else min(int(math.sqrt(len(vectors))), 4096)
+    if nlist > 1:
+        centroids = train_ivf(vectors, nlist)
+        assignments = _assign(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.searchsorted(assignments[order], np.arange(nlist + 1)).astype(np.int64)
+    else:
+        centroids = np.zeros((1, vectors.shape[1]), dtype=np.float32)
+        order = np.arange(len(vectors))
+        list_offsets = np.array([0, len(vectors)], dtype=np.int64)
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "vectors.npy"), vectors[order])
+    np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_path, "lists.npy"), list_offsets)
+    for name, values in (("ids", [ids[i] for i in order]), ("fields", [json.dumps(fields[i]) for i in order])):
+        data, offsets = pack_strings(values)
+        with open(os.path.join(tmp_path, f"{name}.bin"), "wb") as f:
+            f.write(data)
+        np.save(os.path.join(tmp_path, f"{name}_offsets.npy"), offsets)
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    """Read-only, memory-mapped view of a segment written by write_segment.
+
+    Every worker process maps the same files, so the vectors are shared through
+    the OS page cache instead of being copied into each process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.lists = np.load(os.path.join(path, "lists.npy"))
+        self._ids = self._open_packed("ids")
+        self._fields = self._open_packed("fields")
+
+    def _open_packed(self, name):
+        offsets = np.load(os.path.join(self.path, f"{name}_offsets.npy"), mmap_mode="r")
+        data_path = os.path.join(self.path, f"{name}.bin")
+        data = np.memmap(data_path, dtype=np.uint8, mode="r") if os.path.getsize(data_path) else np.empty(0, np.uint8)
+        return data, offsets
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @staticmethod
+    def _read(packed, row):
+        data, offsets = packed
+        return bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def record_id(self, row):
+        return self._read(self._ids, row)
+
+    def fields(self, row):
+        return json.loads(self._read(self._fields, row))
+
+    def all_ids(self):
+        return [self.record_id(row) for row in range(len(self))]
+
+    def search(self, query_vector, k, nprobe=None):
+        """Return (rows, scores) of the approximate top-k by inner product."""
+        nlist = len(self.lists) - 1
+        if nlist == 1:
+            candidates = np.arange(len(self))
+            scores = np.asarray(self.vectors) @ query_vector if len(self) else np.empty(0, np.float32)
+        else:
+            nprobe = min(nlist, nprobe or IVF_NPROBE or max(1, math.ceil(nlist * 0.05)))
+            probed = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+            ranges = [(self.lists[c], self.lists[c + 1]) for c in probed if self.lists[c + 1] > self.lists[c]]
+            if not ranges:
+                return np.empty(0, np.int64), np.empty(0, np.float32)
+            candidates = np.concatenate([np.arange(a, b) for a, b in ranges])
+            scores = np.concatenate([self.vectors[a:b] @ query_vector for a, b in ranges])
+
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
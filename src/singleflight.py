@@ -0,0 +1,221 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+# Identical concurrent work is done once per process and shared: calls by
+# SingleFlight.do, streams by StreamFlights.subscribe / asubscribe.
+
+
+class SingleFlight:
+    """Run fn once for all concurrent callers that pass the same key."""
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._futures[key]
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._futures)}
+
+
+class _Flight:
+    """Chunks of one upstream stream, readable by any number of sync or async subscribers.
+
+    Subscribers read from the start of the buffer, so one that joins late gets the
+    chunks produced so far before the live ones.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        self._waiters = []
+
+    def _wake(self):
+        self.condition.notify_all()
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The subscriber's event loop has already closed
+                pass
+        self._waiters = []
+
+    def append(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self._wake()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self._wake()
+
+    def read(self):
+        position = 0
+        while True:
+            with self.condition:
+                while position == len(self.chunks) and not self.done:
+                    self.condition.wait()
+                chunks = self.chunks[position:]
+                done, error = self.done, self.error
+            yield from chunks
+            position += len(chunks)
+            if done and position == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    async def aread(self):
+        position = 0
+        loop = asyncio.get_running_loop()
+        while True:
+            event = None
+            with self.condition:
+                if position == len(self.chunks) and not self.done:
+                    event = asyncio.Event()
+                    self._waiters.append((loop, event))
+                chunks = self.chunks[position:]
+                done, error = self.done, self.error
+            if event is not None:
+                await event.wait()
+                continue
+            for chunk in chunks:
+                yield chunk
+            position += len(chunks)
+            if done and position == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class StreamFlights:
+    """Share one upstream stream among every concurrent subscriber with the same key.
+
+    The first subscriber starts the upstream: a thread for a generator, a task for an
+    async generator. The upstream keeps going while anyone is still reading, so a
+    subscriber that disconnects does not cut the stream short for the others. If
+    every subscriber leaves, the upstream is closed at its next chunk.
+    """
+
+    def __init__(self):
+        self.streams = 0
+        self.shared = 0
+        self._flights = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.streams += 1
+            else:
+                self.shared += 1
+            with flight.condition:
+                flight.subscribers += 1
+        return flight, leader
+
+    def _leave(self, flight):
+        with flight.condition:
+            flight.subscribers -= 1
+
+    def _retire(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _abandon(self, key, flight):
+        """Retire flight if nobody is reading it. Returns False if a subscriber joined in the meantime.
+
+        Checked under the same lock _join takes, so a late joiner either keeps the upstream
+        going or finds no flight and starts its own, instead of getting a cut-off stream.
+        """
+        with self._lock:
+            if flight.subscribers:
+                return False
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return True
+
+    def _pump(self, key, flight, upstream):
+        error = None
+        try:
+            for chunk in upstream:
+                flight.append(chunk)
+                if not flight.subscribers and self._abandon(key, flight):
+                    break
+        except BaseException as e:
+            error = e
+        finally:
+            upstream.close()
+            self._retire(key, flight)
+            flight.finish(error)
+
+    async def _apump(self, key, flight, upstream):
+        error = None
+        try:
+            async for chunk in upstream:
+                flight.append(chunk)
+                if not flight.subscribers and self._abandon(key, flight):
+                    break
+        except BaseException as e:
+            error = e
+        finally:
+            await upstream.aclose()
+            self._retire(key, flight)
+            flight.finish(error)
+
+    def subscribe(self, key, start):
+        """Yield the chunks of start()'s generator, shared with concurrent subscribers to key."""
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, flight, start()), name="stream-flight", daemon=True).start()
+        try:
+            yield from flight.read()
+        finally:
+            self._leave(flight)
+
+    async def asubscribe(self, key, start):
+        """subscribe for async generators; start() returns an async generator."""
+        flight, leader = self._join(key)
+        if leader:
+            task = asyncio.get_running_loop().create_task(self._apump(key, flight, start()))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        try:
+            async for chunk in flight.aread():
+                yield chunk
+        finally:
+            self._leave(flight)
+
+    def stats(self):
+        with self._lock:
+            return {"streams": self.streams, "shared": self.shared, "in_flight": len(self._flights)}
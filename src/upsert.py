@@ -0,0 +1,131 @@
+import os
+import time
+import heapq
+import random
+import logging
+from itertools import count
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+UPSERT_MAX_IN_FLIGHT = int(os.getenv("UPSERT_MAX_IN_FLIGHT", 4))
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", 3))
+UPSERT_BACKOFF = float(os.getenv("UPSERT_BACKOFF", 0.5))
+# Pinecone accepts at most 96 records per upsert_records call for integrated embedding indexes
+MAX_BATCH_SIZE = 96
+MIN_BATCH_SIZE = 8
+# Consecutive successful batches before the batch size is doubled again after a failure
+GROW_AFTER = 4
+
+
+class UpsertReport:
+    def __init__(self):
+        self.written_batches = 0
+        self.written_records = 0
+        self.retried_batches = 0
+        self.failed_batches = 0
+        self.failed_records = 0
+        self.errors = []
+
+    def summary(self):
+        return (f"{self.written_batches} batches written ({self.written_records} records), "
+                f"{self.retried_batches} retried, {self.failed_batches} failed ({self.failed_records} records)")
+
+
+class UpsertError(RuntimeError):
+    def __init__(self, report):
+        errors = "; ".join(report.errors[-3:])
+        super().__init__(f"Upsert incomplete: {report.summary()}. Last errors: {errors}")
+        self.report = report
+
+
+def _slices(records, size):
+    return [records[i:i+size] for i in range(0, len(records), size)]
+
+
+def upsert_batches(index, namespace, batches, max_in_flight=UPSERT_MAX_IN_FLIGHT, max_retries=UPSERT_MAX_RETRIES,
+                   backoff=UPSERT_BACKOFF, max_batch_size=MAX_BATCH_SIZE, min_batch_size=MIN_BATCH_SIZE,
+                   on_batch=None):
+    """Upsert an iterable of record lists with bounded concurrency and per-batch retries.
+
+    Incoming lists are re-sliced to the current batch size, which halves after a failed
+    call and doubles back towards max_batch_size after a run of successes. Failed slices
+    are retried with exponential backoff; the returned UpsertReport lists what was written,
+    retried and given up on. on_batch(records) is called from this thread after every
+    successful upsert.
+    """
+    report = UpsertReport()
+    batch_size = max_batch_size
+    successes = 0
+
+    source = iter(batches)
+    exhausted = False
+    pending = deque()
+    retries = []
+    sequence = count()
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        def submit(records, attempt):
+            future = pool.submit(index.upsert_records, namespace, records)
+            in_flight[future] = (records, attempt)
+
+        while True:
+            now = time.monotonic()
+            while retries and retries[0][0] <= now and len(in_flight) < max_in_flight:
+                _, _, records, attempt = heapq.heappop(retries)
+                submit(records, attempt)
+
+            while len(in_flight) < max_in_flight:
+                if pending:
+                    submit(pending.popleft(), 0)
+                    continue
+                if exhausted:
+                    break
+                try:
+                    pending.extend(_slices(next(source), batch_size))
+                except StopIteration:
+                    exhausted = True
+
+            if not in_flight:
+                if not retries:
+                    break
+                time.sleep(max(0.0, retries[0][0] - time.monotonic()))
+                continue
+
+            timeout = max(0.0, retries[0][0] - now) if retries else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                records, attempt = in_flight.pop(future)
+                error = future.exception()
+                if error is None:
+                    report.written_batches += 1
+                    report.written_records += len(records)
+                    successes += 1
+                    if successes >= GROW_AFTER and batch_size < max_batch_size:
+                        batch_size = min(max_batch_size, batch_size * 2)
+                        successes = 0
+                    if on_batch:
+                        on_batch(records)
+                    continue
+
+                successes = 0
+                batch_size = max(min_batch_size, batch_size // 2)
+                if attempt >= max_retries:
+                    report.failed_batches += 1
+                    report.failed_records += len(records)
+                    report.errors.append(str(error))
+                    logger.warning("Giving up on %d records in namespace %r: %s", len(records), namespace, error)
+                    continue
+
+                report.retried_batches += 1
+                delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                for piece in _slices(records, batch_size):
+                    heapq.heappush(retries, (time.monotonic() + delay, next(sequence), piece, attempt + 1))
+
+    logger.info("Upsert into namespace %r finished: %s", namespace, report.summary())
+    return report
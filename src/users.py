@@ -0,0 +1,39 @@
+import os
+from dotenv import load_dotenv
+from src.cache import LRUCache
+from src.models import User
+
+load_dotenv()
+
+# Per-process cache of user profiles keyed by username. Unknown usernames are cached too,
+# so signup must call invalidate_user for the new name.
+_profiles = LRUCache(
+    max_entries=int(os.getenv("USER_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("USER_CACHE_TTL", 300)),
+)
+_MISSING = object()
+
+
+def profile(user):
+    """The small, non-secret part of a User kept in the session and the cache."""
+    return {"id": user.id, "username": user.username}
+
+
+def get_profile(username):
+    """Profile dict for username, or None if there is no such user."""
+    cached = _profiles.get(username, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    user = User.query.filter_by(username=username).first()
+    cached = profile(user) if user else None
+    _profiles.set(username, cached)
+    return cached
+
+
+def invalidate_user(username):
+    """Call after creating, renaming or deleting a user."""
+    _profiles.invalidate(lambda key: key == username)
+
+
+def user_cache_stats():
+    return _profiles.stats()
@@ -0,0 +1,419 @@
+import os
+import re
+import time
+import zlib
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+import numpy as np
+from urllib.parse import quote, unquote
+from src.segments import Segment, write_segment
+from src.fakes import FakeIndex
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Every index handle returned by a VectorStore speaks the subset of the Pinecone
+# data-plane API the app uses: upsert_records(namespace, records),
+# search(namespace, query, fields), delete(ids, namespace, delete_all) and
+# describe_index_stats(). Records carry their text in "chunk_text".
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+INDEX_CACHE_TTL = float(os.getenv("INDEX_CACHE_TTL", 3600))
+LOCAL_EMBED_DIM = int(os.getenv("LOCAL_EMBED_DIM", 384))
+# When set, the local backend keeps each namespace as memory-mapped segment files under this directory
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR")
+# Simulated round trip of every call to the fake backend
+FAKE_INDEX_LATENCY = float(os.getenv("FAKE_INDEX_LATENCY", 0.02))
+FAKE_INDEX_JITTER = float(os.getenv("FAKE_INDEX_JITTER", 0.01))
+# Per-namespace lock files of a DiskIndex, kept beside its namespace directories
+LOCKS_DIR = ".locks"
+
+
+class VectorStore:
+    def get_index(self, username):
+        """Return the user's index handle, creating the index if needed."""
+        raise NotImplementedError
+
+    def invalidate(self, username=None):
+        """Forget cached handles for one user, or for everyone."""
+
+    def commit(self, username, namespace):
+        """Make writes to a namespace visible to searches; called once per ingestion."""
+
+
+class PineconeStore(VectorStore):
+    def __init__(self, api_key=None, ttl=INDEX_CACHE_TTL):
+        from pinecone import Pinecone
+        self.pc = Pinecone(api_key=api_key or os.getenv("PINECONE_API_KEY"))
+        self.ttl = ttl
+        self._handles = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _create_index(self, username):
+        if not self.pc.has_index(username):
+            self.pc.create_index_for_model(
+                name=username,
+                cloud="aws",
+                region="us-east-1",
+                embed={"model": "llama-text-embed-v2", "field_map": {"text": "chunk_text"}}
+            )
+        return self.pc.Index(
+            host=f"https://{username}-uzat91r.svc.aped-4627-b74a.pinecone.io"
+        )
+
+    def get_index(self, username):
+        # Handles are cached per process, so the has_index control-plane call and the
+        # index client (with its HTTP connection pool) are set up once per user per TTL
+        entry = self._handles.get(username)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+
+        with self._locks_guard:
+            lock = self._locks.setdefault(username, threading.Lock())
+        with lock:
+            entry = self._handles.get(username)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+            index = self._create_index(username)
+            self._handles[username] = (index, time.monotonic() + self.ttl)
+            return index
+
+    def invalidate(self, username=None):
+        if username is None:
+            self._handles.clear()
+        else:
+            self._handles.pop(username, None)
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder that needs no model or network.
+
+    Words and word bigrams are hashed with CRC32 into dim signed buckets and the
+    result is L2-normalised, so cosine similarity rewards shared vocabulary.
+    """
+
+    def __init__(self, dim=LOCAL_EMBED_DIM):
+        self.dim = dim
+
+    def _features(self, text):
+        words = re.findall(r"\w+", text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in self._features(text)), dtype=np.uint32)
+            if not len(hashes):
+                continue
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class _Namespace:
+    """Normalised vectors in one contiguous float32 array, grown by doubling."""
+
+    def __init__(self, dim):
+        self.ids = []
+        self.fields = []
+        self.rows = {}
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, ids, vectors, fields):
+        needed = len(self.ids) + len(ids)
+        if needed > len(self.vectors):
+            grown = np.empty((max(needed, 2 * len(self.vectors), 64), self.vectors.shape[1]), dtype=np.float32)
+            grown[:len(self.ids)] = self.vectors[:len(self.ids)]
+            self.vectors = grown
+        for record_id, vector, record_fields in zip(ids, vectors, fields):
+            row = self.rows.get(record_id)
+            if row is None:
+                row = len(self.ids)
+                self.rows[record_id] = row
+                self.ids.append(record_id)
+                self.fields.append(record_fields)
+            else:
+                self.fields[row] = record_fields
+            self.vectors[row] = vector
+
+    def delete(self, ids):
+        for record_id in ids:
+            row = self.rows.pop(record_id, None)
+            if row is None:
+                continue
+            last = len(self.ids) - 1
+            if row != last:
+                self.ids[row] = self.ids[last]
+                self.fields[row] = self.fields[last]
+                self.vectors[row] = self.vectors[last]
+                self.rows[self.ids[row]] = row
+            self.ids.pop()
+            self.fields.pop()
+
+    def search(self, query_vector, k):
+        size = len(self.ids)
+        if not size:
+            return [], np.empty(0, dtype=np.float32)
+        scores = self.vectors[:size] @ query_vector
+        if k < size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top]
+
+
+class LocalIndex:
+    """In-process index: one _Namespace per namespace, searched with a dot product."""
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.namespaces = {}
+        self._lock = threading.RLock()
+
+    def upsert_records(self, namespace, records):
+        vectors = self.embedder.embed([record["chunk_text"] for record in records])
+        with self._lock:
+            store = self.namespaces.setdefault(namespace, _Namespace(self.embedder.dim))
+            store.upsert([record["_id"] for record in records], vectors,
+                         [{k: v for k, v in record.items() if k != "_id"} for record in records])
+
+    def search(self, namespace, query, fields=None):
+        query_vector = self.embedder.embed([query["inputs"]["text"]])[0]
+        with self._lock:
+            store = self.namespaces.get(namespace)
+            if store is None:
+                return {"result": {"hits": []}}
+            rows, scores = store.search(query_vector, query.get("top_k", 10))
+            hits = [{
+                "_id": store.ids[row],
+                "_score": float(score),
+                "fields": {k: v for k, v in store.fields[row].items() if fields is None or k in fields},
+            } for row, score in zip(rows, scores)]
+        return {"result": {"hits": hits}}
+
+    def delete(self, ids=None, namespace=None, delete_all=False):
+        with self._lock:
+            if delete_all:
+                self.namespaces.pop(namespace, None)
+            elif namespace in self.namespaces:
+                self.namespaces[namespace].delete(ids or [])
+
+    def describe_index_stats(self):
+        with self._lock:
+            return {"namespaces": {name: {"vector_count": len(store)} for name, store in self.namespaces.items()}}
+
+    def commit(self, namespace):
+        pass
+
+
+class DiskIndex:
+    """Local index whose namespaces are immutable, memory-mapped segments under root.
+
+    Upserts and deletes are buffered and applied by commit(namespace). A commit writes
+    a new segment generation and atomically repoints the namespace's CURRENT file at it,
+    so searches in every worker process see either the old or the new generation.
+    delete_all takes effect immediately. Commits and delete_all hold a per-namespace
+    file lock, so concurrent commits from several processes apply one after the other.
+    """
+
+    def __init__(self, root, embedder):
+        self.root = root
+        self.embedder = embedder
+        self._pending = {}
+        self._segments = {}
+        self._lock = threading.RLock()
+
+    def _dir(self, namespace):
+        return os.path.join(self.root, quote(namespace, safe=""))
+
+    @contextmanager
+    def _namespace_lock(self, namespace):
+        # Outside the namespace directory, which delete_all and an emptying commit remove
+        directory = os.path.join(self.root, LOCKS_DIR)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, quote(namespace, safe="")), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _generation(self, namespace):
+        try:
+            with open(os.path.join(self._dir(namespace), "CURRENT")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _segment(self, namespace):
+        generation = self._generation(namespace)
+        if generation is None:
+            return None
+        cached = self._segments.get(namespace)
+        if cached and cached[0] == generation:
+            return cached[1]
+        segment = Segment(os.path.join(self._dir(namespace), generation))
+        self._segments[namespace] = (generation, segment)
+        return segment
+
+    def upsert_records(self, namespace, records):
+        vectors = self.embedder.embed([record["chunk_text"] for record in records])
+        with self._lock:
+            upserts, deletes = self._pending.setdefault(namespace, ({}, set()))
+            for record, vector in zip(records, vectors):
+                upserts[record["_id"]] = (vector, {k: v for k, v in record.items() if k != "_id"})
+                deletes.discard(record["_id"])
+
+    def delete(self, ids=None, namespace=None, delete_all=False):
+        with self._lock:
+            if delete_all:
+                self._pending.pop(namespace, None)
+                self._segments.pop(namespace, None)
+                with self._namespace_lock(namespace):
+                    shutil.rmtree(self._dir(namespace), ignore_errors=True)
+                return
+            upserts, deletes = self._pending.setdefault(namespace, ({}, set()))
+            for record_id in ids or []:
+                upserts.pop(record_id, None)
+                deletes.add(record_id)
+
+    def commit(self, namespace):
+        with self._lock:
+            upserts, deletes = self._pending.pop(namespace, ({}, set()))
+            if not upserts and not deletes:
+                return
+            # Held from reading the current generation until CURRENT names the new one, so a
+            # commit in another process can neither rebuild from a stale generation nor delete this one
+            with self._namespace_lock(namespace):
+                self._apply(namespace, upserts, deletes)
+
+    def _apply(self, namespace, upserts, deletes):
+        ids, fields, vectors = [], [], []
+        replaced = self._generation(namespace)
+        segment = self._segment(namespace)
+        if segment is not None:
+            existing = segment.all_ids()
+            keep = [row for row, record_id in enumerate(existing)
+                    if record_id not in upserts and record_id not in deletes]
+            ids = [existing[row] for row in keep]
+            fields = [segment.fields(row) for row in keep]
+            vectors.append(np.asarray(segment.vectors[keep]))
+        ids.extend(upserts)
+        fields.extend(record_fields for _, record_fields in upserts.values())
+        vectors.extend(vector[None, :] for vector, _ in upserts.values())
+
+        directory = self._dir(namespace)
+        if not ids:
+            self._segments.pop(namespace, None)
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        generation = f"gen-{time.time_ns()}"
+        write_segment(os.path.join(directory, generation), ids, fields, np.vstack(vectors))
+        with open(os.path.join(directory, "CURRENT.tmp"), "w") as f:
+            f.write(generation)
+        os.replace(os.path.join(directory, "CURRENT.tmp"), os.path.join(directory, "CURRENT"))
+        # Processes that still map the replaced generation keep reading it until they reopen
+        if replaced is not None and replaced != generation:
+            shutil.rmtree(os.path.join(directory, replaced), ignore_errors=True)
+
+    def search(self, namespace, query, fields=None):
+        query_vector = self.embedder.embed([query["inputs"]["text"]])[0]
+        try:
+            segment = self._segment(namespace)
+        except FileNotFoundError:
+            # CURRENT moved on between reading it and opening the generation it named
+            segment = self._segment(namespace)
+        if segment is None:
+            return {"result": {"hits": []}}
+
+        rows, scores = segment.search(query_vector, query.get("top_k", 10))
+        hits = []
+        for row, score in zip(rows, scores):
+            record_fields = segment.fields(row)
+            hits.append({
+                "_id": segment.record_id(row),
+                "_score": float(score),
+                "fields": {k: v for k, v in record_fields.items() if fields is None or k in fields},
+            })
+        return {"result": {"hits": hits}}
+
+    def describe_index_stats(self):
+        namespaces = {}
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if name == LOCKS_DIR:
+                    continue
+                segment = self._segment(unquote(name))
+                if segment is not None:
+                    namespaces[unquote(name)] = {"vector_count": len(segment)}
+        return {"namespaces": namespaces}
+
+
+class LocalStore(VectorStore):
+    def __init__(self, embedder=None, root=LOCAL_VECTOR_DIR):
+        self.embedder = embedder or HashingEmbedder()
+        self.root = root
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get_index(self, username):
+        with self._lock:
+            if username not in self._indexes:
+                if self.root:
+                    self._indexes[username] = DiskIndex(os.path.join(self.root, quote(username, safe="")), self.embedder)
+                else:
+                    self._indexes[username] = LocalIndex(self.embedder)
+            return self._indexes[username]
+
+    def commit(self, username, namespace):
+        self.get_index(username).commit(namespace)
+
+
+class FakeStore(VectorStore):
+    """One in-memory FakeIndex per user, for load tests that must not touch Pinecone.
+
+    Each process has its own indexes, so run load tests against a single worker.
+    """
+
+    def __init__(self, latency=FAKE_INDEX_LATENCY, jitter=FAKE_INDEX_JITTER):
+        self.latency = latency
+        self.jitter = jitter
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get_index(self, username):
+        with self._lock:
+            if username not in self._indexes:
+                self._indexes[username] = FakeIndex(latency=self.latency, jitter=self.jitter)
+            return self._indexes[username]
+
+
+_BACKENDS = {
+    "pinecone": PineconeStore,
+    "local": LocalStore,
+    "fake": FakeStore,
+}
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if VECTOR_STORE not in _BACKENDS:
+                    raise ValueError(f"Unknown VECTOR_STORE '{VECTOR_STORE}', expected one of {sorted(_BACKENDS)}")
+                _store = _BACKENDS[VECTOR_STORE]()
+    return _store
@@ -46,7 +46,11 @@ uploadInput.addEventListener('change', async () => {
         }
 
         addMessage('bot', `Uploaded: ${file.name}`);
-        addMessage('bot', data.message);
+        const status = await waitForIngestion(data.job_id);
+        addMessage('bot', status.message);
+        if (status.stage !== 'done') {
+            throw new Error(status.message || 'Indexing failed.');
+        }
         await loadPDFs();
     } catch (err) {
         console.error('Upload error:', err);
@@ -59,6 +63,21 @@ uploadInput.addEventListener('change', async () => {
     }
 });
 
+// Slightly longer than the server's INGEST_JOB_TIMEOUT, which fails jobs lost to a restart
+const MAX_INGEST_WAIT_MS = 65 * 60 * 1000;
+
+async function waitForIngestion(jobId) {
+    const deadline = Date.now() + MAX_INGEST_WAIT_MS;
+    while (Date.now() < deadline) {
+        const response = await fetch(`/ingest_status/${jobId}`);
+        const status = await response.json();
+        if (!response.ok || status.stage === 'done' || status.stage === 'failed') {
+            return status;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+    return { stage: 'failed', message: 'Indexing is taking too long, please check back later.' };
+}
 
 dropdownList.addEventListener('click', (e) => {
     const item = e.target.closest('.dropdown-item');
@@ -66,7 +85,7 @@ dropdownList.addEventListener('click', (e) => {
     if (e.target.classList.contains('trash')) return;
     const val = item.dataset.value;
     selectedNamespace = val;
-    dropdownToggle.textContent = val || 'Base LLM ⏷';
+    dropdownToggle.textContent = val === '__all__' ? 'All documents' : (val || 'Base LLM ⏷');
     dropdownList.classList.add('hidden');
 });
 
@@ -75,6 +94,9 @@ async function loadPDFs() {
     const pdfs = await response.json();
 
     dropdownList.innerHTML = `<div class="dropdown-item" data-value="">Base LLM</div>`;
+    if (pdfs.length > 1) {
+        dropdownList.innerHTML += `<div class="dropdown-item" data-value="__all__">All documents</div>`;
+    }
 
     pdfs.forEach(pdf => {
         const item = document.createElement('div');
@@ -125,7 +147,7 @@ form.addEventListener('submit', function (e) {
 
 
 
-function addMessage(sender, text, timeValue = null) {
+function addMessage(sender, text, timeValue = null, container = chatWindow) {
     const messageWrapper = document.createElement('div');
     messageWrapper.classList.add('message', sender);
 
@@ -146,7 +168,7 @@ function addMessage(sender, text, timeValue = null) {
     messageWrapper.appendChild(messageText);
     messageWrapper.appendChild(time);
 
-    chatWindow.appendChild(messageWrapper);
+    container.appendChild(messageWrapper);
     chatWindow.scrollTop = chatWindow.scrollHeight;
 }
 
@@ -200,31 +222,63 @@ function streamBotResponse(userMessage) {
         });
 }
 
-async function loadHistory() {
-    const response = await fetch('/get_history');
-    const history = await response.json();
+// Cursor for the next page of older history; null once everything is shown
+let historyCursor = null;
 
+async function loadHistory(before = null) {
+    const params = new URLSearchParams({ limit: 50 });
+    if (before) params.set('before', before);
+    const response = await fetch(`/get_history?${params}`);
+    const page = await response.json();
+
+    // Older pages are rendered off-screen and inserted above what is already shown
+    const fragment = document.createElement('div');
     let lastDate = null;
 
-    history.forEach(chat => {
+    page.items.forEach(chat => {
         const ts = new Date(chat.timestamp);
         const dateStr = ts.toDateString();
 
         if (dateStr !== lastDate) {
-            insertDateSeparator(dateStr);
+            insertDateSeparator(dateStr, fragment);
             lastDate = dateStr;
         }
 
-        addMessage('user', chat.user_message, chat.timestamp);
-        addMessage('bot', chat.bot_response, chat.timestamp);
+        addMessage('user', chat.user_message, chat.timestamp, fragment);
+        addMessage('bot', chat.bot_response, chat.timestamp, fragment);
     });
+
+    const previousHeight = chatWindow.scrollHeight;
+    const firstShown = document.getElementById('load-older')?.nextSibling || chatWindow.firstChild;
+    // Drop the date separator the next page repeats
+    if (firstShown && firstShown.classList?.contains('date-separator') && firstShown.textContent === lastDate) {
+        firstShown.remove();
+    }
+    document.getElementById('load-older')?.remove();
+    chatWindow.prepend(...fragment.childNodes);
+
+    historyCursor = page.next_cursor;
+    if (historyCursor) {
+        const button = document.createElement('button');
+        button.id = 'load-older';
+        button.className = 'load-older';
+        button.textContent = 'Load older messages';
+        button.addEventListener('click', () => loadHistory(historyCursor));
+        chatWindow.prepend(button);
+    }
+
+    if (before) {
+        chatWindow.scrollTop += chatWindow.scrollHeight - previousHeight;
+    } else {
+        chatWindow.scrollTop = chatWindow.scrollHeight;
+    }
 }
 
-function insertDateSeparator(dateStr) {
+function insertDateSeparator(dateStr, container = chatWindow) {
     const separator = document.createElement('div');
     separator.classList.add('date-separator');
     separator.textContent = dateStr;
-    chatWindow.appendChild(separator);
+    container.appendChild(separator);
 }
 
 window.onload = () => {
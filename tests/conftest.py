@@ -0,0 +1,43 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+# Tests import the app's modules as src.*, the same way app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Set before any test module is collected: src.* read their settings at import time
+_workdir = tempfile.mkdtemp(prefix="rag-chatbot-tests-")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.environ.update({
+    "OPENAI_API_KEY": "unused",
+    "PINECONE_API_KEY": "unused",
+    "SECRET_KEY": "test",
+    "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(_workdir, 'app.db')}",
+    "RATELIMIT_ENABLED": "false",
+    "VECTOR_STORE": "fake",
+    "HISTORY_SPILL_DIR": os.path.join(_workdir, "spill"),
+    "LEXICAL_INDEX_DIR": os.path.join(_workdir, "lexical"),
+    "LOCAL_VECTOR_DIR": os.path.join(_workdir, "vectors"),
+    "ADMISSION_SQLITE_PATH": os.path.join(_workdir, "admission.db"),
+})
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The Flask app on a throwaway SQLite database, with fake vectors and a stub OpenAI client."""
+    import src.helper
+    from app import app
+
+    def create(model, messages, stream):
+        return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="An answer."),
+                                                              finish_reason="stop")])])
+
+    src.helper.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    app.test_client().get("/create_db")
+    return app
@@ -0,0 +1,77 @@
+"""Token budget charges: estimated at admission, trued up against the real prompt and answer."""
+import sqlite3
+
+import pytest
+
+import src.admission
+from src.admission import AdmissionControl, AdmissionRejected, MemoryBackend, OUTPUT_TOKEN_RESERVE, SQLiteBackend
+from src.context import CONTEXT_TOKEN_BUDGET
+
+BUDGET = 100000
+
+
+@pytest.fixture(autouse=True)
+def offline_tokenizer(monkeypatch):
+    # Lets count_tokens fall back to approximate counts where tiktoken can't download its BPE file
+    monkeypatch.setenv("VECTOR_STORE", "fake")
+
+
+@pytest.fixture
+def control():
+    # window=0 stops refills, so the bucket moves only by what is charged
+    return AdmissionControl(backend=MemoryBackend(), budget=BUDGET, window=0, max_concurrency=4)
+
+
+def _left(control, user_id=1):
+    return control.backend.take(f"user:{user_id}", 0, BUDGET, 0)[1]
+
+
+def test_context_budget_is_reserved_only_when_retrieving(control):
+    history = [{"role": "user", "content": "Hello there"}]
+    without = control.estimate_prompt("What does the report say?", history)
+    assert control.estimate_prompt("What does the report say?", history, retrieves=True) == without + CONTEXT_TOKEN_BUDGET
+
+
+def test_admit_charges_estimate_and_reserve(control):
+    ticket = control.admit(1, 1200)
+    assert ticket.charged == 1200 + OUTPUT_TOKEN_RESERVE
+    assert _left(control) == BUDGET - 1200 - OUTPUT_TOKEN_RESERVE
+
+
+def test_settle_trues_up_prompt_and_answer(control):
+    ticket = control.admit(1, 1200)
+    ticket.prompt_sent(300)
+    control.settle(ticket, 80)
+    assert _left(control) == BUDGET - 300 - 80
+
+
+def test_settle_without_a_sent_prompt_keeps_the_estimate(control):
+    ticket = control.admit(1, 1200)
+    control.settle(ticket, 80)
+    assert _left(control) == BUDGET - 1200 - 80
+
+
+def test_settle_releases_the_slot_once(control):
+    control.max_concurrency = 1
+    ticket = control.admit(1, 100)
+    ticket.prompt_sent(100)
+    ticket.settle("An answer.")
+    ticket.settle("An answer.")
+    assert control.admit(2, 100).slot is not None
+
+
+def test_locked_backend_refuses_as_busy(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.admission, "ADMISSION_SQLITE_TIMEOUT", 0.05)
+    path = str(tmp_path / "admission.db")
+    control = AdmissionControl(backend=SQLiteBackend(path), budget=BUDGET, window=0, max_concurrency=4)
+    # Another process holding the write lock
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(AdmissionRejected) as rejected:
+            control.admit(1, 100)
+    finally:
+        holder.execute("ROLLBACK")
+    assert rejected.value.retry_after == 1
+    assert control.counts["busy"] == 1
+    assert control.admit(1, 100).slot is not None
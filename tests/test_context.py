@@ -0,0 +1,31 @@
+"""Context packing keeps retrieval's order and stays within the token budget."""
+import pytest
+from langchain.schema import Document
+
+from src.context import count_tokens, pack_context
+
+
+@pytest.fixture(autouse=True)
+def offline_tokenizer(monkeypatch):
+    monkeypatch.setenv("VECTOR_STORE", "fake")
+
+
+def _doc(text, **metadata):
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_keeps_retrieval_order_for_lexical_hits():
+    exact = _doc("Error E-102 means the pump lost pressure.", score=0.0, bm25=9.1, rrf=0.033)
+    dense = _doc("Pumps are serviced every six months.", score=0.81, rrf=0.016)
+    context, _, used = pack_context([exact, dense])
+    assert used == 2
+    assert context.startswith(exact.page_content)
+
+
+def test_last_chunks_are_trimmed_or_dropped_to_fit():
+    docs = [_doc(" ".join(f"word{i}" for i in range(200)), rrf=1 / (61 + rank)) for rank in range(3)]
+    per_doc = count_tokens(docs[0].page_content)
+    context, tokens, used = pack_context(docs, budget=per_doc + 100)
+    assert tokens <= per_doc + 100
+    assert used == 2
+    assert context.startswith(docs[0].page_content)
@@ -0,0 +1,37 @@
+"""Re-ingesting a namespace writes only what changed."""
+from io import BytesIO
+
+from benchmarks.synthetic import make_pdf
+
+
+def test_unchanged_reupload_makes_no_index_writes(app):
+    from src.helper import create_or_get_index, update_index_from_stream
+
+    pdf = make_pdf(3)
+    with app.app_context():
+        update_index_from_stream("judy", "manual", BytesIO(pdf), workers=1)
+        index = create_or_get_index("judy")
+        before = dict(index.calls)
+        assert before["upsert_records"] > 0
+
+        message, chunks = update_index_from_stream("judy", "manual", BytesIO(pdf), workers=1)
+
+    assert index.calls["upsert_records"] == before["upsert_records"]
+    assert index.calls["delete"] == before["delete"]
+    assert chunks == len(index.namespaces["manual"])
+    assert "0 new, 0 removed" in message
+
+
+def test_changed_reupload_writes_only_the_difference(app):
+    from src.helper import create_or_get_index, update_index_from_stream
+
+    with app.app_context():
+        update_index_from_stream("kim", "manual", BytesIO(make_pdf(3)), workers=1)
+        index = create_or_get_index("kim")
+        before = dict(index.calls)
+        message, chunks = update_index_from_stream("kim", "manual", BytesIO(make_pdf(2)), workers=1)
+
+    assert index.calls["upsert_records"] == before["upsert_records"]
+    assert index.calls["delete"] == before["delete"] + 1
+    assert chunks == len(index.namespaces["manual"])
+    assert "0 new" in message
@@ -0,0 +1,40 @@
+"""The lexical index builder spills postings to disk without changing the index it writes."""
+import random
+
+import numpy as np
+
+from benchmarks.synthetic import make_page_text
+from src.lexical import LexicalIndex, LexicalIndexBuilder, index_path, search_lexical
+
+
+def _records(count):
+    rng = random.Random(0)
+    return [{"_id": f"chunk-{i}", "chunk_text": make_page_text(rng, i, 2), "token_count": i} for i in range(count)]
+
+
+def _build(username, records, spill_postings):
+    builder = LexicalIndexBuilder(spill_postings=spill_postings)
+    for record in records:
+        builder.add(record)
+    builder.save(username, "manual")
+    return builder
+
+
+def test_spilled_runs_write_the_same_index():
+    records = _records(40)
+    _build("in-memory", records, spill_postings=10 ** 9)
+    spilled = _build("spilled", records, spill_postings=50)
+    assert len(spilled.runs) > 5
+
+    with np.load(index_path("in-memory", "manual")) as expected, np.load(index_path("spilled", "manual")) as actual:
+        assert expected.files == actual.files
+        for name in expected.files:
+            assert np.array_equal(expected[name], actual[name]), name
+
+    for query in ("fault code E-0101", "pump pressure valve", "section 3.2"):
+        assert search_lexical("spilled", "manual", query, 5) == search_lexical("in-memory", "manual", query, 5)
+
+
+def test_empty_builder_writes_an_empty_index():
+    _build("empty", [], spill_postings=50)
+    assert LexicalIndex(index_path("empty", "manual")).search("pump", 5) == []
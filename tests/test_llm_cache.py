@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+from src.llm import AnswerCache, astream_chat, cache_key, stream_chat
+
+MESSAGES = [{"role": "user", "content": "What does the report say?"}]
+
+
+def _chunk(content=None, finish_reason=None):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content),
+                                                    finish_reason=finish_reason)])
+
+
+def _events(words, finish):
+    return [_chunk(word) for word in words] + ([_chunk(finish_reason="stop")] if finish else [])
+
+
+class StubClient:
+    """Stands in for OpenAI(): streams words and counts upstream calls."""
+
+    def __init__(self, words=("The ", "report ", "says ", "yes."), finish=True):
+        self.words = words
+        self.finish = finish
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, stream):
+        self.calls += 1
+        return iter(_events(self.words, self.finish))
+
+
+class AsyncStubClient(StubClient):
+    async def create(self, model, messages, stream):
+        self.calls += 1
+
+        async def events():
+            for event in _events(self.words, self.finish):
+                yield event
+        return events()
+
+
+def test_second_identical_request_is_replayed_from_the_cache():
+    client, cache = StubClient(), AnswerCache()
+    first = list(stream_chat(client, MESSAGES, cache=cache))
+    second = list(stream_chat(client, MESSAGES, cache=cache))
+    assert first == second == ["The ", "report ", "says ", "yes."]
+    assert client.calls == 1
+
+
+def test_stream_without_finish_reason_is_not_cached():
+    client, cache = StubClient(finish=False), AnswerCache()
+    list(stream_chat(client, MESSAGES, cache=cache))
+    list(stream_chat(client, MESSAGES, cache=cache))
+    assert client.calls == 2
+    assert cache.get(cache_key("gpt-3.5-turbo", MESSAGES)) is None
+
+
+def test_least_recently_used_answer_is_evicted():
+    client, cache = StubClient(), AnswerCache(max_entries=2)
+    questions = [[{"role": "user", "content": f"question {i}"}] for i in range(3)]
+    for messages in questions:
+        list(stream_chat(client, messages, cache=cache))
+    list(stream_chat(client, questions[2], cache=cache))
+    assert client.calls == 3
+    list(stream_chat(client, questions[0], cache=cache))
+    assert client.calls == 4
+    assert cache.stats()["evictions"] >= 1
+
+
+def test_disk_tier_is_shared_and_promoted_into_memory(tmp_path):
+    client = StubClient()
+    list(stream_chat(client, MESSAGES, cache=AnswerCache(directory=str(tmp_path))))
+
+    # A second process sees the same directory but starts with an empty memory tier
+    other = AnswerCache(directory=str(tmp_path))
+    assert list(stream_chat(client, MESSAGES, cache=other)) == list(client.words)
+    assert client.calls == 1
+    assert other.stats()["disk_hits"] == 1
+    assert other.memory.get(cache_key("gpt-3.5-turbo", MESSAGES)) is not None
+
+
+def test_expired_disk_entries_are_ignored(tmp_path):
+    cache = AnswerCache(directory=str(tmp_path), ttl=60)
+    cache.set("k" * 64, ["old"])
+    path = cache._path("k" * 64)
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    assert AnswerCache(directory=str(tmp_path), ttl=60).get("k" * 64) is None
+    assert not os.path.exists(path)
+
+
+def test_prune_removes_oldest_entries_past_the_size_limit(tmp_path):
+    cache = AnswerCache(directory=str(tmp_path), max_disk_bytes=200)
+    for i in range(5):
+        key = f"{i:064d}"
+        cache.set(key, ["x" * 80])
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    cache.prune()
+    remaining = sorted(name for _, _, names in os.walk(tmp_path) for name in names)
+    assert remaining == [f"{i:064d}.json" for i in (3, 4)]
+
+
+def test_async_stream_shares_the_cache_with_the_sync_path(tmp_path):
+    async def collect(client, cache):
+        return [content async for content in astream_chat(client, MESSAGES, cache=cache)]
+
+    client = AsyncStubClient()
+    assert asyncio.run(collect(client, AnswerCache(directory=str(tmp_path)))) == list(client.words)
+    sync_client = StubClient()
+    assert list(stream_chat(sync_client, MESSAGES, cache=AnswerCache(directory=str(tmp_path)))) == list(client.words)
+    assert client.calls == 1 and sync_client.calls == 0
@@ -0,0 +1,59 @@
+"""Conversation memory kept per process stays in step with ChatHistory written by other workers."""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def worker(app):
+    """Memory of one worker process; the ChatHistory rows stand in for what the others wrote."""
+    from src.memory import ConversationMemory
+    return ConversationMemory()
+
+
+def _user(app, username):
+    from src.models import db, User
+    with app.app_context():
+        user = User(username=username, password="unused")
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def _insert(app, user_id, user_message, bot_response, seconds=0):
+    # What another worker's history writer does when it flushes
+    from src.models import db, ChatHistory
+    with app.app_context():
+        db.session.add(ChatHistory(user_id=user_id, user_message=user_message, bot_response=bot_response,
+                                   timestamp=datetime.utcnow() + timedelta(seconds=seconds)))
+        db.session.commit()
+
+
+def _said(messages):
+    return [message["content"] for message in messages if message["role"] == "user"]
+
+
+def test_turns_from_other_workers_are_picked_up(app, worker):
+    user_id = _user(app, "erin")
+    _insert(app, user_id, "first question", "first answer")
+    with app.app_context():
+        assert _said(worker.history("erin", user_id)) == ["first question"]
+
+    _insert(app, user_id, "second question", "second answer", seconds=1)
+    with app.app_context():
+        assert _said(worker.history("erin", user_id)) == ["first question", "second question"]
+
+
+def test_own_turns_are_not_repeated_once_flushed(app, worker):
+    user_id = _user(app, "frank")
+    with app.app_context():
+        assert worker.history("frank", user_id) == []
+    worker.add_turn("frank", "my question", "my answer")
+    with app.app_context():
+        assert _said(worker.history("frank", user_id)) == ["my question"]
+
+    # The history writer flushes the turn this worker added, then another worker serves one
+    _insert(app, user_id, "my question", "my answer")
+    _insert(app, user_id, "elsewhere", "another answer", seconds=1)
+    with app.app_context():
+        assert _said(worker.history("frank", user_id)) == ["my question", "elsewhere"]
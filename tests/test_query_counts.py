@@ -0,0 +1,107 @@
+"""Database round trips per request once a user is logged in."""
+import threading
+
+import pytest
+from sqlalchemy import event
+
+
+@pytest.fixture
+def queries(app):
+    """Statements run on this thread; the history writer's background inserts are not counted."""
+    from src.models import db
+
+    statements = []
+    thread = threading.get_ident()
+
+    def count(conn, cursor, statement, *args):
+        if threading.get_ident() == thread:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    yield statements
+    event.remove(engine, "before_cursor_execute", count)
+
+
+def logged_in(app, username):
+    client = app.test_client()
+    client.post("/signup", data={"username": username, "password": "Passw0rd!"})
+    client.post("/login", data={"username": username, "password": "Passw0rd!"})
+    return client
+
+
+def chat(client, message, namespace=None):
+    response = client.post("/chat", json={"message": message, "namespace": namespace})
+    assert response.status_code == 200
+    response.get_data()
+    response.close()
+
+
+def test_base_chat_reads_memory_in_one_query(app, queries):
+    client = logged_in(app, "alice")
+    queries.clear()
+    chat(client, "first question")
+    assert len(queries) == 1
+
+    # Memory is checked against ChatHistory every turn, for turns other workers served
+    queries.clear()
+    chat(client, "second question")
+    assert len(queries) == 1
+
+
+def test_all_documents_chat_lists_the_users_pdfs(app, queries):
+    client = logged_in(app, "bob")
+    queries.clear()
+    with app.app_context():
+        from src.models import db, User, UserPDF
+        user_id = User.query.filter_by(username="bob").one().id
+        db.session.add_all([UserPDF(user_id=user_id, pdf_name="report"), UserPDF(user_id=user_id, pdf_name="notes")])
+        db.session.commit()
+
+    # The PDF list and the conversation memory, in one query
+    queries.clear()
+    chat(client, "first question", namespace="__all__")
+    assert len(queries) <= 1
+
+    queries.clear()
+    chat(client, "second question", namespace="__all__")
+    assert len(queries) <= 1
+
+    from app import chat_context
+    with app.app_context():
+        namespace, namespaces, history = chat_context("bob", user_id, "__all__")
+    assert namespace is None and sorted(namespaces) == ["notes", "report"]
+    assert [m["content"] for m in history if m["role"] == "user"] == ["first question", "second question"]
+
+
+def test_get_pdfs_is_one_query(app, queries):
+    client = logged_in(app, "carol")
+    queries.clear()
+    assert client.get("/get_pdfs").status_code == 200
+    assert len(queries) == 1
+
+
+def test_get_history_page_from_the_hot_table_is_one_query(app, queries):
+    from datetime import datetime, timedelta
+    from src.models import db, ChatHistory, User
+
+    client = logged_in(app, "dave")
+    with app.app_context():
+        user_id = User.query.filter_by(username="dave").one().id
+        now = datetime.utcnow()
+        db.session.execute(db.insert(ChatHistory), [
+            {"user_id": user_id, "user_message": f"q{i}", "bot_response": "a", "timestamp": now + timedelta(seconds=i)}
+            for i in range(5)])
+        db.session.commit()
+
+    queries.clear()
+    page = client.get("/get_history?limit=2").get_json()
+    assert len(page["items"]) == 2
+    assert len(queries) == 1
+
+    # The last page runs out of hot rows and also looks in the archive
+    cursor = client.get(f"/get_history?limit=2&before={page['next_cursor']}").get_json()["next_cursor"]
+    queries.clear()
+    assert len(client.get(f"/get_history?limit=2&before={cursor}").get_json()["items"]) == 1
+    assert len(queries) == 2
@@ -0,0 +1,59 @@
+"""Cached search results are retired when any worker changes the namespace."""
+import threading
+
+import pytest
+from langchain.schema import Document
+
+
+@pytest.fixture
+def searches():
+    return []
+
+
+@pytest.fixture
+def helper(app, monkeypatch, searches):
+    """src.helper with a search that returns a new result each time it is called."""
+    import src.helper
+
+    def search(query, username, namespace, k):
+        searches.append(query)
+        return [Document(page_content=f"result {len(searches)}", metadata={"id": str(len(searches))})]
+
+    monkeypatch.setattr(src.helper, "_hybrid_search", search)
+    monkeypatch.setattr(src.helper, "diversify", lambda candidates, k: candidates)
+    return src.helper
+
+
+def test_repeat_searches_are_cached(helper, searches):
+    first = helper.retrieve_query("what is it", "gina", "report")
+    assert helper.retrieve_query("What is it?", "gina", "report") == first
+    assert len(searches) == 1
+
+
+def test_invalidation_by_another_worker_is_seen(helper):
+    from src.lexical import bump_generation
+
+    helper.retrieve_query("what is it", "hank", "report")
+    # Another worker re-ingested the namespace; this process's cache was never told
+    bump_generation("hank", "report")
+    assert helper.retrieve_query("what is it", "hank", "report")[0].page_content == "result 2"
+
+
+def test_search_racing_an_invalidation_is_not_served_afterwards(helper, searches, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    search = helper._hybrid_search
+
+    def slow_first(query, username, namespace, k):
+        if not searches:
+            started.set()
+            release.wait()
+        return search(query, username, namespace, k)
+
+    monkeypatch.setattr(helper, "_hybrid_search", slow_first)
+    racing = threading.Thread(target=helper.retrieve_query, args=("what is it", "ivy", "report"))
+    racing.start()
+    started.wait()
+    helper.invalidate_retrieval_cache("ivy", "report")
+    release.set()
+    racing.join()
+    assert helper.retrieve_query("what is it", "ivy", "report")[0].page_content == "result 2"
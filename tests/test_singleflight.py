@@ -0,0 +1,36 @@
+import threading
+
+from src.singleflight import StreamFlights
+
+
+def gated_upstream(gate):
+    yield "a"
+    gate.wait(5)
+    yield "b"
+    yield "c"
+
+
+def test_subscriber_joining_as_the_last_one_leaves_gets_the_whole_stream():
+    flights = StreamFlights()
+    gate = threading.Event()
+    joined = {}
+    checked = threading.Event()
+    abandon = flights._abandon
+
+    def join_then_abandon(key, flight):
+        # A request arrives just as the pump finds nobody reading
+        joined["stream"] = flights.subscribe(key, lambda: gated_upstream(threading.Event()))
+        joined["first"] = next(joined["stream"])
+        checked.set()
+        return abandon(key, flight)
+
+    flights._abandon = join_then_abandon
+    first = flights.subscribe("key", lambda: gated_upstream(gate))
+    assert next(first) == "a"
+    first.close()
+    gate.set()
+    assert checked.wait(5)
+
+    stream = [joined["first"], *joined["stream"]]
+    assert stream == ["a", "b", "c"]
+    assert flights.stats()["streams"] == 1
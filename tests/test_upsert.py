@@ -0,0 +1,70 @@
+"""The upsert engine against FakeIndex: retries, giving up, and the in-flight bound."""
+import threading
+
+from src.fakes import FakeIndex, FakeIndexError
+from src.upsert import upsert_batches
+
+
+class FlakyIndex(FakeIndex):
+    """Fails the first failures upserts, then behaves; tracks how many upserts overlap."""
+
+    def __init__(self, failures=0, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.active = 0
+        self.peak = 0
+        self._count_lock = threading.Lock()
+
+    def upsert_records(self, namespace, records):
+        with self._count_lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            failing = self.failures > 0
+            self.failures -= failing
+        try:
+            if failing:
+                raise FakeIndexError("injected upsert_records failure")
+            super().upsert_records(namespace, records)
+        finally:
+            with self._count_lock:
+                self.active -= 1
+
+
+def _batches(count, size):
+    return [[{"_id": f"c{batch}-{i}", "chunk_text": f"chunk {batch} {i}"} for i in range(size)]
+            for batch in range(count)]
+
+
+def test_failed_batch_is_retried_and_written():
+    index = FlakyIndex(failures=1)
+    report = upsert_batches(index, "report", _batches(3, 10), backoff=0, max_batch_size=10, min_batch_size=10)
+    assert report.written_records == 30
+    assert report.retried_batches == 1
+    assert report.failed_batches == 0
+    assert len(index.namespaces["report"]) == 30
+
+
+def test_batch_is_given_up_after_max_retries():
+    index = FakeIndex(error_rate=1.0)
+    report = upsert_batches(index, "report", _batches(1, 10), max_retries=2, backoff=0,
+                            max_batch_size=10, min_batch_size=10)
+    assert (report.written_batches, report.retried_batches, report.failed_batches) == (0, 2, 1)
+    assert report.failed_records == 10
+    assert report.errors == ["injected upsert_records failure"]
+    assert index.calls["upsert_records"] == 3
+
+
+def test_failed_batch_is_split_before_retrying():
+    index = FlakyIndex(failures=1)
+    report = upsert_batches(index, "report", _batches(1, 16), max_in_flight=1, backoff=0,
+                            max_batch_size=16, min_batch_size=8)
+    assert report.written_batches == 2
+    assert report.written_records == 16
+
+
+def test_in_flight_upserts_are_bounded():
+    index = FlakyIndex(latency=0.02)
+    written = []
+    report = upsert_batches(index, "report", _batches(20, 5), max_in_flight=3, on_batch=written.extend)
+    assert report.written_records == len(written) == 100
+    assert index.peak == 3
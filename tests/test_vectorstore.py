@@ -0,0 +1,45 @@
+"""DiskIndex commits from several processes sharing one directory."""
+import os
+import threading
+
+from src.vectorstore import DiskIndex, HashingEmbedder
+
+
+def _records(prefix, count):
+    return [{"_id": f"{prefix}-{i}", "chunk_text": f"{prefix} pump valve {i}"} for i in range(count)]
+
+
+def test_concurrent_commits_keep_every_upsert(tmp_path):
+    # One DiskIndex per "process"; each has its own buffers and in-process lock
+    embedder = HashingEmbedder()
+    workers = [DiskIndex(str(tmp_path), embedder) for _ in range(4)]
+    start = threading.Barrier(len(workers))
+
+    def ingest(number, index):
+        for round_ in range(5):
+            index.upsert_records("manual", _records(f"w{number}r{round_}", 3))
+            if round_ == 0:
+                start.wait()
+            index.commit("manual")
+
+    threads = [threading.Thread(target=ingest, args=(number, index)) for number, index in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reader = DiskIndex(str(tmp_path), embedder)
+    assert reader.describe_index_stats()["namespaces"] == {"manual": {"vector_count": 4 * 5 * 3}}
+    generations = [name for name in os.listdir(tmp_path / "manual") if name.startswith("gen-")]
+    assert generations == [(tmp_path / "manual" / "CURRENT").read_text()]
+
+
+def test_delete_all_then_commit_starts_empty(tmp_path):
+    index = DiskIndex(str(tmp_path), HashingEmbedder())
+    index.upsert_records("manual", _records("old", 2))
+    index.commit("manual")
+    index.delete(namespace="manual", delete_all=True)
+    index.upsert_records("manual", _records("new", 1))
+    index.commit("manual")
+    hits = index.search("manual", {"inputs": {"text": "pump valve"}, "top_k": 10})["result"]["hits"]
+    assert [hit["_id"] for hit in hits] == ["new-0"]